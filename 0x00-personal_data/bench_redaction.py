@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Benchmark redaction throughput over synthetic log records
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import platform
+import random
+import subprocess
+import time
+from typing import Callable, Dict, List, Tuple
+
+from filtered_logger import (PII_FIELDS, RedactingFormatter,
+                             RedactionEngine, TrieRedactionEngine,
+                             filter_datum, row_renderer)
+
+
+REDACTION = RedactingFormatter.REDACTION
+SEPARATOR = RedactingFormatter.SEPARATOR
+
+
+def make_fields(count: int) -> List[str]:
+    """
+    Field list of the given size, starting with PII_FIELDS.
+    """
+    extra = ["pii_{}".format(i) for i in range(count - len(PII_FIELDS))]
+    return list(PII_FIELDS[:count]) + extra
+
+
+def make_rows(
+    lines: int, pairs: int, fields: List[str], pii_share: float,
+    seed: int = 0
+) -> List[Dict[str, str]]:
+    """
+    Synthetic rows where about pii_share of the keys are sensitive.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(lines):
+        row = {}
+        for i in range(pairs):
+            if rng.random() < pii_share:
+                key = rng.choice(fields)
+            else:
+                key = "attr_{}".format(i)
+            row[key] = "value-{:08x}".format(rng.getrandbits(32))
+        rows.append(row)
+    return rows
+
+
+def render(row: Dict[str, str]) -> str:
+    """
+    Render a row as a log line of key=value pairs, each one closed by
+    SEPARATOR as the message engines need to find where a value ends.
+    """
+    return "{} ".format(SEPARATOR).join(
+        "{}={}".format(key, value) for key, value in row.items()
+    ) + SEPARATOR
+
+
+def make_record(msg) -> logging.LogRecord:
+    """
+    Build a log record around a message.
+    """
+    return logging.LogRecord(
+        "user_data", logging.INFO, __file__, 0, msg, None, None
+    )
+
+
+def strategies(
+    fields: List[str]
+) -> Dict[str, Tuple[Callable, Callable]]:
+    """
+    Redaction strategies as (prepare(row), run(prepared)) pairs.
+    """
+    engine = RedactionEngine(fields, REDACTION, SEPARATOR)
+    trie = TrieRedactionEngine(fields, REDACTION, SEPARATOR)
+    formatter = RedactingFormatter(fields)
+    return {
+        "filter_datum": (
+            render,
+            lambda msg: filter_datum(fields, REDACTION, msg, SEPARATOR)
+        ),
+        "engine": (render, engine.redact),
+        "trie": (render, trie.redact),
+        "formatter": (
+            lambda row: make_record(render(row)), formatter.format
+        ),
+        "formatter_structured": (make_record, formatter.format),
+        # Rows of a result set share their columns, so export_users
+        # builds the renderer once and only the per-row call is timed
+        "row_renderer": (
+            lambda row: (row_renderer(tuple(row), fields),
+                         tuple(row.values())),
+            lambda item: item[0](item[1])
+        ),
+    }
+
+
+def check_separators(fields: List[str], rows: List[Dict[str, str]]) -> None:
+    """
+    Fail unless every engine redacts alike, including separators that
+    are regex syntax.
+    """
+    for separator in (SEPARATOR, '|', '.', '*', '$', '||', '.*'):
+        engine = RedactionEngine(fields, REDACTION, separator)
+        trie = TrieRedactionEngine(fields, REDACTION, separator)
+        for row in rows:
+            msg = "{} ".format(separator).join(
+                "{}={}".format(k, v) for k, v in row.items()
+            ) + separator
+            expected = trie.redact(msg)
+            for got in (engine.redact(msg),
+                        filter_datum(fields, REDACTION, msg, separator)):
+                if got != expected:
+                    raise SystemExit("separator {!r}: {!r} != {!r}".format(
+                        separator, got, expected))
+
+
+def bench(run: Callable, items: list, min_time: float) -> float:
+    """
+    Best seconds per pass over items, repeating for at least min_time.
+    """
+    best = float('inf')
+    deadline = time.perf_counter() + min_time
+    while True:
+        start = time.perf_counter()
+        for item in items:
+            run(item)
+        best = min(best, time.perf_counter() - start)
+        if time.perf_counter() >= deadline:
+            return best
+
+
+def git_revision() -> str:
+    """
+    Current commit, if run from a git checkout.
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    """
+    Run the benchmark grid and save the results as JSON.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('-o', '--output', default='bench_redaction.json')
+    parser.add_argument('--lines', type=int, default=1000)
+    parser.add_argument('--pairs', type=int, nargs='+', default=[4, 16, 64],
+                        help="key=value pairs per line")
+    parser.add_argument('--fields', type=int, nargs='+',
+                        default=[5, 50, 500], help="size of the field list")
+    parser.add_argument('--pii-share', type=float, nargs='+',
+                        default=[0.0, 0.25, 1.0],
+                        help="fraction of keys that are sensitive")
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help="seconds spent per measurement")
+    args = parser.parse_args()
+
+    check_separators(make_fields(50), make_rows(100, 16, make_fields(50), 0.5))
+
+    results = []
+    grid = itertools.product(args.pairs, args.fields, args.pii_share)
+    for pairs, n_fields, pii_share in grid:
+        fields = make_fields(n_fields)
+        rows = make_rows(args.lines, pairs, fields, pii_share)
+        total_bytes = sum(len(render(row)) for row in rows)
+        for name, (prepare, run) in strategies(fields).items():
+            items = [prepare(row) for row in rows]
+            seconds = bench(run, items, args.min_time)
+            result = {
+                "strategy": name,
+                "pairs": pairs,
+                "fields": n_fields,
+                "pii_share": pii_share,
+                "lines_per_sec": args.lines / seconds,
+                "ns_per_byte": seconds * 1e9 / total_bytes,
+            }
+            results.append(result)
+            print("{strategy:>22} pairs={pairs:<3} fields={fields:<4} "
+                  "pii={pii_share:<4} {lines_per_sec:>12,.0f} lines/s "
+                  "{ns_per_byte:>8.2f} ns/byte".format(**result))
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "lines": args.lines,
+            "results": results,
+        }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
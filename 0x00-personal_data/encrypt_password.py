@@ -4,6 +4,77 @@ Password encryption module
 """
 
 import bcrypt
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+
+DEFAULT_ROUNDS = 12
+MIN_ROUNDS = 10
+MAX_ROUNDS = 31
+
+_rounds = None
+_rounds_lock = threading.Lock()
+
+
+def calibrate_rounds(
+    target_ms: float, min_rounds: int = MIN_ROUNDS,
+    max_rounds: int = MAX_ROUNDS
+) -> int:
+    """
+    Pick the highest bcrypt cost whose hash time stays within target_ms
+    on this machine, never going below min_rounds.
+    """
+    salt = bcrypt.gensalt(rounds=min_rounds)
+    # Take the best of a few runs to filter out scheduling noise
+    elapsed = min(
+        _time_hash(b'calibration password', salt) for _ in range(3)
+    )
+    rounds = min_rounds
+    # Each extra round doubles the work
+    while rounds < max_rounds and elapsed * 2 * 1000 <= target_ms:
+        rounds += 1
+        elapsed *= 2
+    return rounds
+
+
+def _time_hash(password: bytes, salt: bytes) -> float:
+    """
+    Seconds taken by one bcrypt hash.
+    """
+    start = time.perf_counter()
+    bcrypt.hashpw(password, salt)
+    return time.perf_counter() - start
+
+
+def get_rounds() -> int:
+    """
+    Work factor for new hashes.
+
+    PERSONAL_DATA_BCRYPT_ROUNDS fixes the cost; otherwise
+    PERSONAL_DATA_BCRYPT_TARGET_MS calibrates it once per process.
+    Without either, bcrypt's default cost is used.
+    """
+    global _rounds
+    if _rounds is not None:
+        return _rounds
+    # Concurrent first callers wait for a single calibration, which
+    # would otherwise time bcrypt against each other and pick a cost
+    # too low, and different in each thread
+    with _rounds_lock:
+        if _rounds is None:
+            rounds = os.getenv('PERSONAL_DATA_BCRYPT_ROUNDS')
+            target_ms = os.getenv('PERSONAL_DATA_BCRYPT_TARGET_MS')
+            if rounds:
+                _rounds = int(rounds)
+            elif target_ms:
+                _rounds = calibrate_rounds(float(target_ms))
+            else:
+                _rounds = DEFAULT_ROUNDS
+    return _rounds
 
 
 def hash_password(password: str) -> bytes:
@@ -13,7 +84,9 @@ def hash_password(password: str) -> bytes:
     # Encode the password to bytes
     password_bytes = password.encode('utf-8')
     # Generate a hashed password
-    hashed_password = bcrypt.hashpw(password_bytes, bcrypt.gensalt())
+    hashed_password = bcrypt.hashpw(
+        password_bytes, bcrypt.gensalt(rounds=get_rounds())
+    )
     return hashed_password
 
 
@@ -25,3 +98,74 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
     password_bytes = password.encode('utf-8')
     # Check if the provided password matches the hashed password
     return bcrypt.checkpw(password_bytes, hashed_password)
+
+
+def needs_rehash(hashed_password: bytes) -> bool:
+    """
+    Check if a stored hash was made with a different cost than the
+    current one.
+    """
+    # bcrypt hashes look like b'$2b$12$<salt and digest>'
+    parts = hashed_password.split(b'$')
+    if len(parts) != 4 or not parts[2].isdigit():
+        return True
+    return int(parts[2]) != get_rounds()
+
+
+def verify_and_upgrade(
+    hashed_password: bytes, password: str
+) -> Tuple[bool, Optional[bytes]]:
+    """
+    Check a password and return a fresh hash at the current cost when
+    the stored one is outdated.
+
+    Returns (valid, new_hash); new_hash is None unless it must be stored.
+    """
+    if not is_valid(hashed_password, password):
+        return False, None
+    if needs_rehash(hashed_password):
+        return True, hash_password(password)
+    return True, None
+
+
+def _map_ordered(
+    func: Callable, items: Iterable, max_workers: int = None
+) -> Iterator:
+    """
+    Apply func to items on a thread pool, yielding results in input order.
+    """
+    # bcrypt releases the GIL while hashing, so threads run in parallel
+    max_workers = max_workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Only a bounded window is in flight, so large inputs are
+        # consumed lazily and results are handed back as they are ready
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, *item))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def hash_passwords(
+    passwords: Iterable[str], max_workers: int = None
+) -> Iterator[bytes]:
+    """
+    Hash many passwords concurrently, yielding hashes in input order.
+    """
+    # Calibrated before the workers start, so it runs on an idle machine
+    get_rounds()
+    return _map_ordered(
+        hash_password, ((password,) for password in passwords), max_workers
+    )
+
+
+def verify_many(
+    pairs: Iterable[Tuple[bytes, str]], max_workers: int = None
+) -> Iterator[bool]:
+    """
+    Check many (hashed_password, password) pairs concurrently,
+    yielding results in input order.
+    """
+    return _map_ordered(is_valid, pairs, max_workers)
@@ -7,8 +7,162 @@ and connect to a secure database
 import logging
 import mysql.connector
 import os
+import queue
 import re
-from typing import List
+import resource
+import threading
+import time
+from functools import lru_cache
+from operator import itemgetter
+from typing import Any, Callable, Iterable, Iterator, List, Mapping, Sequence
+
+
+class RedactionEngine:
+    """
+    Redaction rules for a set of fields, compiled once and reused.
+    """
+
+    def __init__(
+        self, fields: Sequence[str], redaction: str, separator: str
+    ):
+        """
+        Compile a single alternation pattern for the given fields.
+        """
+        self.fields = tuple(fields)
+        self.redaction = redaction
+        self.separator = separator
+        # A single-character separator lets the value be matched with a
+        # negated class instead of a lazy scan; both stop at the first
+        # separator on the same line
+        if len(separator) == 1:
+            value = '[^{}\\n]*'.format(re.escape(separator))
+        else:
+            value = '.*?'
+        # The separator is a literal, so characters like '|' or '.'
+        # must not act as regex syntax
+        self._pattern = re.compile('({})={}{}'.format(
+            '|'.join(self.fields), value, re.escape(separator)
+        ))
+        suffix = '={}{}'.format(redaction, separator)
+        self._replace = lambda match: match.group(1) + suffix
+
+    def redact(self, message: str) -> str:
+        """
+        Obfuscate the configured fields in the log message.
+        """
+        if not self.fields:
+            return message
+        return self._pattern.sub(self._replace, message)
+
+
+class TrieRedactionEngine:
+    """
+    Redaction for large field lists, matched with a trie of reversed
+    field names instead of a regex alternation.
+
+    Every field ends right before an '=', so the message is scanned once
+    for '=' and the trie is walked backwards from each one. The work per
+    '=' is bounded by the longest field name, not by the number of
+    fields. Output is the same as RedactionEngine for plain field names.
+    """
+
+    _END = ''
+
+    def __init__(
+        self, fields: Sequence[str], redaction: str, separator: str
+    ):
+        """
+        Build the reversed trie for the given fields.
+        """
+        self.fields = tuple(fields)
+        self.redaction = redaction
+        self.separator = separator
+        self._trie = {}
+        for field in self.fields:
+            node = self._trie
+            for char in reversed(field):
+                node = node.setdefault(char, {})
+            node[self._END] = True
+
+    def _field_start(self, message: str, start: int, equals: int) -> int:
+        """
+        Leftmost index i >= start such that message[i:equals] is a field,
+        or -1 if there is none.
+        """
+        found = -1
+        node = self._trie
+        for i in range(equals - 1, start - 1, -1):
+            node = node.get(message[i])
+            if node is None:
+                break
+            if self._END in node:
+                found = i
+        return found
+
+    def _value_end(self, message: str, equals: int) -> int:
+        """
+        Index right after the separator closing the value, or -1 if the
+        value is not terminated on the same line.
+        """
+        end = message.find(self.separator, equals + 1)
+        if end == -1 or message.find('\n', equals + 1, end) != -1:
+            return -1
+        return end + len(self.separator)
+
+    def redact(self, message: str) -> str:
+        """
+        Obfuscate the configured fields in the log message.
+        """
+        parts = []
+        pos = 0
+        while True:
+            equals = message.find('=', pos)
+            if equals == -1:
+                break
+            end = self._value_end(message, equals)
+            start = -1 if end == -1 else \
+                self._field_start(message, pos, equals)
+            if start == -1:
+                # Nothing can match before this '=' any more
+                parts.append(message[pos:equals + 1])
+                pos = equals + 1
+                continue
+            parts.append(message[pos:equals + 1])
+            parts.append(self.redaction)
+            parts.append(self.separator)
+            pos = end
+        if not parts:
+            return message
+        parts.append(message[pos:])
+        return ''.join(parts)
+
+
+# Above this many fields the trie is faster than the regex alternation
+TRIE_THRESHOLD = 150
+_PLAIN_FIELD = re.compile(r'\w+')
+
+
+def make_engine(fields: Sequence[str], redaction: str, separator: str):
+    """
+    Build the fastest engine for a set of fields.
+
+    Fields that are not plain names keep the regex engine, since the
+    trie matches them literally.
+    """
+    if len(fields) > TRIE_THRESHOLD and \
+            all(_PLAIN_FIELD.fullmatch(field) for field in fields):
+        return TrieRedactionEngine(fields, redaction, separator)
+    return RedactionEngine(fields, redaction, separator)
+
+
+@lru_cache(maxsize=32)
+def _get_engine(
+    fields: tuple, redaction: str, separator: str
+) -> RedactionEngine:
+    """
+    Return the cached engine for a (fields, redaction, separator) triple.
+    """
+    return make_engine(fields, redaction, separator)
 
 
 def filter_datum(
@@ -18,12 +172,24 @@ def filter_datum(
     """
     Obfuscate the given fields in the log message.
     """
-    pattern = '|'.join(f'{field}=.*?{separator}' for field in fields)
-    return re.sub(
-        pattern,
-        lambda m: f'{m.group(0).split("=")[0]}={redaction}{separator}',
-        message
-    )
+    return _get_engine(tuple(fields), redaction, separator).redact(message)
+
+
+class _Redacted(str):
+    """
+    Message rendered with its PII already replaced by export_users.
+
+    fields holds the columns that were replaced, so a formatter only
+    trusts the message when they cover its own fields.
+    """
+
+    def __new__(cls, message: str, fields: Iterable[str]):
+        """
+        Wrap a rendered message with the fields it was redacted for.
+        """
+        self = super().__new__(cls, message)
+        self.fields = frozenset(fields)
+        return self
 
 
 class RedactingFormatter(logging.Formatter):
@@ -39,15 +205,37 @@ class RedactingFormatter(logging.Formatter):
         """
         super().__init__(self.FORMAT)
         self.fields = fields
+        self.engine = make_engine(fields, self.REDACTION, self.SEPARATOR)
+        self.field_set = frozenset(fields)
+
+    def redact_mapping(self, data: Mapping) -> str:
+        """
+        Render a mapping as key=value pairs with PII values replaced.
+        """
+        fields = self.field_set
+        return "{} ".format(self.SEPARATOR).join(
+            "{}={}".format(key, self.REDACTION if key in fields else value)
+            for key, value in data.items()
+        )
 
     def format(self, record: logging.LogRecord) -> str:
         """
         Format the log record by redacting specified fields.
         """
-        return filter_datum(
-            self.fields, self.REDACTION,
-            super().format(record), self.SEPARATOR
-        )
+        if type(record.msg) is _Redacted and \
+                record.msg.fields >= self.field_set:
+            # export_users already replaced the PII values; a private
+            # type rather than a record attribute, so callers cannot
+            # opt out of redaction through extra=
+            return super().format(record)
+        if isinstance(record.msg, Mapping):
+            # Structured records are redacted by key before rendering,
+            # on a copy so other handlers still see the raw mapping
+            record = logging.makeLogRecord(record.__dict__)
+            record.msg = self.redact_mapping(record.msg)
+            record.args = None
+            return super().format(record)
+        return self.engine.redact(super().format(record))
 
 
 # Define PII_FIELDS from user_data.csv
@@ -72,9 +260,10 @@ def get_logger() -> logging.Logger:
     return logger
 
 
-def get_db() -> mysql.connector.connection.MySQLConnection:
+def connect_db() -> mysql.connector.connection.MySQLConnection:
     """
-    Get a database connection using credentials from environment variables.
+    Open a new database connection using credentials from
+    environment variables.
     """
     # Retrieve environment variables with default values
     db_user = os.getenv('PERSONAL_DATA_DB_USERNAME', 'root')
@@ -97,19 +286,274 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
     return connection
 
 
+class PooledConnection:
+    """
+    Proxy to a pooled connection; close() hands it back to the pool.
+    """
+
+    def __init__(self, pool: 'ConnectionPool', connection, created_at: float):
+        """
+        Wrap a connection checked out from the pool.
+        """
+        self._pool = pool
+        self._connection = connection
+        self._created_at = created_at
+
+    def __getattr__(self, name: str):
+        """
+        Delegate everything else to the underlying connection.
+        """
+        if self._connection is None:
+            raise AttributeError("connection returned to the pool")
+        return getattr(self._connection, name)
+
+    def close(self) -> None:
+        """
+        Return the connection to the pool instead of closing it.
+        """
+        if self._connection is not None:
+            self._pool.release(self._connection, self._created_at)
+            self._connection = None
+
+
+class ConnectionPool:
+    """
+    Bounded pool of database connections.
+
+    Connections are checked with is_connected() when handed out and
+    replaced once they are older than max_lifetime seconds.
+    """
+
+    def __init__(
+        self, connect: Callable[[], Any], size: int,
+        max_lifetime: float = 0, timeout: float = None
+    ):
+        """
+        Create an empty pool; connections are opened on demand.
+        """
+        self._connect = connect
+        self.size = size
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self.created = 0
+        self.checkouts = 0
+
+    def _usable(self, connection, created_at: float) -> bool:
+        """
+        Check an idle connection before handing it out again.
+        """
+        if self.max_lifetime > 0 and \
+                time.monotonic() - created_at > self.max_lifetime:
+            return False
+        try:
+            return connection.is_connected()
+        except Exception:
+            return False
+
+    def get_connection(self) -> PooledConnection:
+        """
+        Check out a healthy connection, opening one if needed.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise queue.Empty("no database connection available")
+        try:
+            while True:
+                try:
+                    connection, created_at = self._idle.get_nowait()
+                except queue.Empty:
+                    connection = self._connect()
+                    created_at = time.monotonic()
+                    self.created += 1
+                    break
+                if self._usable(connection, created_at):
+                    break
+                self._discard(connection)
+        except BaseException:
+            self._slots.release()
+            raise
+        self.checkouts += 1
+        return PooledConnection(self, connection, created_at)
+
+    def release(self, connection, created_at: float) -> None:
+        """
+        Put a connection back into the pool.
+        """
+        self._idle.put((connection, created_at))
+        self._slots.release()
+
+    def _discard(self, connection) -> None:
+        """
+        Close a connection that is no longer usable.
+        """
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        """
+        Close every idle connection.
+        """
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(connection)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """
+    Return the process-wide pool configured from environment variables.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            timeout = os.getenv('PERSONAL_DATA_DB_POOL_TIMEOUT')
+            _pool = ConnectionPool(
+                connect_db,
+                int(os.getenv('PERSONAL_DATA_DB_POOL_SIZE', '1')),
+                float(os.getenv('PERSONAL_DATA_DB_POOL_MAX_LIFETIME', '0')),
+                float(timeout) if timeout else None
+            )
+        return _pool
+
+
+def get_db() -> mysql.connector.connection.MySQLConnection:
+    """
+    Get a database connection using credentials from environment variables.
+
+    When PERSONAL_DATA_DB_POOL_SIZE is set, the connection comes from a
+    shared pool and close() returns it there.
+    """
+    if int(os.getenv('PERSONAL_DATA_DB_POOL_SIZE', '0')) > 0:
+        return get_pool().get_connection()
+    return connect_db()
+
+
+def iter_batches(cursor, batch_size: int) -> Iterator[list]:
+    """
+    Yield the rows of an executed cursor, batch_size rows at a time.
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def row_renderer(
+    columns: Sequence[str], fields: Sequence[str] = PII_FIELDS,
+    redaction: str = RedactingFormatter.REDACTION,
+    separator: str = RedactingFormatter.SEPARATOR
+) -> Callable[[tuple], str]:
+    """
+    Build a function that renders a row tuple as key=value pairs with
+    the PII columns already replaced.
+
+    The column layout is resolved once, so each row costs a single
+    str.format call with no regex pass.
+    """
+    fields = frozenset(fields)
+    keep = []
+    parts = []
+    for index, column in enumerate(columns):
+        if column in fields:
+            value = redaction.replace('{', '{{').replace('}', '}}')
+        else:
+            value = '{}'
+            keep.append(index)
+        parts.append('{}={}'.format(
+            column.replace('{', '{{').replace('}', '}}'), value
+        ))
+    template = '{} '.format(separator).join(parts)
+
+    if not keep:
+        line = template.format()
+        return lambda row: line
+    if len(keep) == 1:
+        index = keep[0]
+        return lambda row: template.format(row[index])
+    getter = itemgetter(*keep)
+    return lambda row: template.format(*getter(row))
+
+
+def logger_fields(logger: logging.Logger) -> frozenset:
+    """
+    Fields redacted by the RedactingFormatter handlers a record of the
+    logger reaches, or PII_FIELDS when there is none.
+    """
+    fields = set()
+    current = logger
+    while current is not None:
+        for handler in current.handlers:
+            if isinstance(handler.formatter, RedactingFormatter):
+                fields |= handler.formatter.field_set
+        current = current.parent if current.propagate else None
+    return frozenset(fields or PII_FIELDS)
+
+
+def export_users(
+    logger: logging.Logger,
+    db: mysql.connector.connection.MySQLConnection,
+    batch_size: int
+) -> int:
+    """
+    Stream the users table through the logger in bounded batches.
+    """
+    # An unbuffered cursor leaves the result set on the server, so only
+    # one batch is held in memory at any time
+    cursor = db.cursor(buffered=False)
+    start = time.perf_counter()
+    count = 0
+    try:
+        cursor.execute("SELECT * FROM users;")
+        # PII columns are known from the result metadata, so rows are
+        # rendered already redacted and the formatter skips its regex
+        fields = logger_fields(logger)
+        render = row_renderer(cursor.column_names, fields)
+        for rows in iter_batches(cursor, batch_size):
+            for row in rows:
+                logger.info(_Redacted(render(row), fields))
+            count += len(rows)
+    finally:
+        cursor.close()
+
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    logger.info(
+        "exported %d rows in %.2fs (%.0f rows/sec), peak RSS %d KiB",
+        count, elapsed, count / elapsed if elapsed else 0.0, peak_rss
+    )
+    return count
+
+
 def main() -> None:
     """
     Main function to fetch and display user data with filtered PII.
     """
     logger = get_logger()
     db = get_db()
+
+    # A positive batch size switches to the streaming export
+    batch_size = int(os.getenv('PERSONAL_DATA_EXPORT_BATCH_SIZE', '0'))
+    if batch_size > 0:
+        export_users(logger, db, batch_size)
+        db.close()
+        return
+
     cursor = db.cursor(dictionary=True)
 
     cursor.execute("SELECT * FROM users;")
     for row in cursor:
-        # Construct log message
-        message = "; ".join(f"{key}={value}" for key, value in row.items())
-        logger.info(message)
+        # Rows are logged as mappings and redacted by key
+        logger.info(row)
 
     cursor.close()
     db.close()
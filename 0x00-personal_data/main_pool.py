@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Check connection pool reuse and checkout latency against a stand-in
+backend, without a MySQL server.
+"""
+import queue
+import time
+
+from filtered_logger import ConnectionPool
+
+
+class FakeConnection:
+    """ Stand-in connection with a simulated handshake cost """
+
+    HANDSHAKE = 0.005
+    opened = []
+
+    def __init__(self):
+        """ Pay the handshake and mark the connection open """
+        time.sleep(self.HANDSHAKE)
+        self.open = True
+        FakeConnection.opened.append(self)
+
+    def is_connected(self) -> bool:
+        """ Health check used by the pool """
+        return self.open
+
+    def close(self) -> None:
+        """ Close the connection """
+        self.open = False
+
+
+def checkout_latency(pool: ConnectionPool, rounds: int) -> float:
+    """ Average seconds per checkout/return cycle """
+    start = time.perf_counter()
+    for _ in range(rounds):
+        pool.get_connection().close()
+    return (time.perf_counter() - start) / rounds
+
+
+if __name__ == "__main__":
+    rounds = 200
+
+    pool = ConnectionPool(FakeConnection, size=4)
+    latency = checkout_latency(pool, rounds)
+    assert pool.created == 1
+    assert pool.checkouts == rounds
+    print("pooled:   {:.1f} us/checkout, {} connection(s) opened".format(
+        latency * 1e6, pool.created))
+
+    unpooled = ConnectionPool(FakeConnection, size=4, max_lifetime=1e-9)
+    latency = checkout_latency(unpooled, rounds)
+    assert unpooled.created == rounds
+    print("recycled: {:.1f} us/checkout, {} connection(s) opened".format(
+        latency * 1e6, unpooled.created))
+
+    # A connection that dropped while idle is replaced on checkout
+    db = pool.get_connection()
+    FakeConnection.opened[0].open = False
+    db.close()
+    db = pool.get_connection()
+    assert db.is_connected()
+    assert pool.created == 2
+    db.close()
+
+    # The pool never hands out more than size connections at once
+    bounded = ConnectionPool(FakeConnection, size=2, timeout=0.01)
+    held = [bounded.get_connection(), bounded.get_connection()]
+    try:
+        bounded.get_connection()
+    except queue.Empty:
+        pass
+    else:
+        raise AssertionError("pool exceeded its size")
+    for db in held:
+        db.close()
+    print("OK")
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Redact PII fields from existing log files in parallel
+"""
+
+import argparse
+import mmap
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Iterator, List, Tuple
+
+from filtered_logger import PII_FIELDS, RedactingFormatter, filter_datum
+
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def split_chunks(
+    mm: mmap.mmap, chunk_size: int
+) -> Iterator[Tuple[int, int]]:
+    """
+    Yield (start, end) offsets of chunks that end on a line boundary.
+    """
+    size = len(mm)
+    start = 0
+    while start < size:
+        end = mm.find(b'\n', min(start + max(chunk_size, 1), size) - 1)
+        end = size if end == -1 else end + 1
+        yield start, end
+        start = end
+
+
+def redact_chunk(
+    file_path: str, start: int, end: int,
+    fields: List[str], redaction: str, separator: str
+) -> bytes:
+    """
+    Redact the lines between two offsets of a file.
+    """
+    with open(file_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            text = mm[start:end].decode('utf-8', 'surrogateescape')
+    # Values never span a newline, so a whole chunk redacts the same
+    # as each of its lines on its own
+    text = filter_datum(fields, redaction, text, separator)
+    return text.encode('utf-8', 'surrogateescape')
+
+
+def redact_file(
+    file_path: str, output: BinaryIO,
+    fields: List[str] = PII_FIELDS,
+    redaction: str = RedactingFormatter.REDACTION,
+    separator: str = RedactingFormatter.SEPARATOR,
+    jobs: int = None, chunk_size: int = CHUNK_SIZE
+) -> int:
+    """
+    Write a redacted copy of a log file, keeping the line order.
+    """
+    if os.path.getsize(file_path) == 0:
+        return 0
+    jobs = jobs or os.cpu_count() or 1
+    fields = list(fields)
+    written = 0
+
+    with open(file_path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+            ProcessPoolExecutor(max_workers=jobs) as executor:
+        # Keep a bounded window of chunks in flight so results are
+        # written in order without piling up in memory
+        pending = deque()
+        for start, end in split_chunks(mm, chunk_size):
+            pending.append(executor.submit(
+                redact_chunk, file_path, start, end,
+                fields, redaction, separator
+            ))
+            if len(pending) >= 2 * jobs:
+                written += output.write(pending.popleft().result())
+        while pending:
+            written += output.write(pending.popleft().result())
+
+    return written
+
+
+def main() -> None:
+    """
+    Command line entry point.
+    """
+    parser = argparse.ArgumentParser(
+        description="Redact PII fields from an existing log file."
+    )
+    parser.add_argument('input', help="log file to redact")
+    parser.add_argument('output', nargs='?', default='-',
+                        help="destination file (default: stdout)")
+    parser.add_argument('-f', '--fields', default=','.join(PII_FIELDS),
+                        help="comma separated fields to redact")
+    parser.add_argument('-r', '--redaction',
+                        default=RedactingFormatter.REDACTION)
+    parser.add_argument('-s', '--separator',
+                        default=RedactingFormatter.SEPARATOR)
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="worker processes (default: CPU count)")
+    parser.add_argument('-c', '--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="approximate bytes per chunk")
+    args = parser.parse_args()
+
+    fields = [field for field in args.fields.split(',') if field]
+    if args.output == '-':
+        redact_file(args.input, sys.stdout.buffer, fields, args.redaction,
+                    args.separator, args.jobs, args.chunk_size)
+        sys.stdout.buffer.flush()
+    else:
+        with open(args.output, 'wb') as output:
+            redact_file(args.input, output, fields, args.redaction,
+                        args.separator, args.jobs, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
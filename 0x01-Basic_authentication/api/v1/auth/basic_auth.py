@@ -3,6 +3,7 @@
 Basic Authentication module for the API
 """
 from api.v1.auth.auth import Auth
+from models.password import PasswordPoolFull
 from models.user import User
 from typing import TypeVar, Tuple
 import base64
@@ -80,20 +81,20 @@ class BasicAuth(Auth):
             if user_pwd is None or not isinstance(user_pwd, str):
                 return None
 
-            # Search for the user by email
-            user_list = User.search({"email": user_email})
-            if not user_list:
+            # Retrieve the first user with this email
+            user = User.first({"email": user_email})
+            if user is None:
                 return None
 
-            # Retrieve the first user from the list
-            user = user_list[0]
-
             # Validate the user's password
             if not user.is_valid_password(user_pwd):
                 return None
 
             return user
 
+        except PasswordPoolFull:
+            # An overloaded server, not wrong credentials
+            raise
         except Exception as e:
             return None
 
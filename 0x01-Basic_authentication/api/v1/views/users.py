@@ -2,18 +2,31 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import abort, current_app, jsonify, request
+from models.listing import JsonListing
 from models.user import User
 
 
+# Payload of GET /api/v1/users, re-assembled only when a user changed
+users_listing = JsonListing()
+
+
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
     Return:
       - list of all User objects JSON represented
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    config = current_app.config
+    if config["JSONIFY_PRETTYPRINT_REGULAR"] or current_app.debug or \
+            not config["JSON_SORT_KEYS"] or not config["JSON_AS_ASCII"]:
+        # The cached text is the compact, sorted, ASCII form jsonify
+        # gives by default
+        all_users = [user.to_json() for user in User.all()]
+        return jsonify(all_users)
+    return current_app.response_class(
+        users_listing.render(User.all()) + "\n",
+        mimetype=config["JSONIFY_MIMETYPE"])
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
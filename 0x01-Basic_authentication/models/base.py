@@ -2,36 +2,95 @@
 """ Base module
 """
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from itertools import islice
 import json
+from typing import TypeVar, List, Iterable, Iterator, Tuple
+import atexit
 import uuid
 
+from models.engine import make_storage
+
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
-DATA = {}
+
+# Storage engine selected by STORAGE_ENGINE: "file" (default) keeps
+# objects in memory and in .db_<Class>.json files, "sqlite" keeps them
+# in an SQLite database
+storage = make_storage()
+
+_SLOT_NAMES = {}
+_UNSET = object()
+# Slots holding derived state rather than attributes of the object
+_CACHE_SLOTS = ('_cache',)
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ Parse a TIMESTAMP_FORMAT string
+    """
+    # Stored timestamps always have this exact shape, which the C ISO
+    # parser reads far faster than strptime
+    if len(value) == 19 and value[4] == '-' and value[7] == '-' and \
+            value[10] == 'T' and value[13] == ':' and value[16] == ':':
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def format_timestamp(value: datetime) -> str:
+    """ Format a datetime as TIMESTAMP_FORMAT
+    """
+    # isoformat() gives the same text for naive datetimes with a
+    # four-digit year once microseconds are dropped
+    if value.tzinfo is None and value.year >= 1000:
+        if value.microsecond:
+            value = value.replace(microsecond=0)
+        return value.isoformat()
+    return value.strftime(TIMESTAMP_FORMAT)
+
+
+def flush(cls: type = None):
+    """ Write pending storage changes of one class, or of all classes
+    """
+    storage.flush(cls)
+
+
+# Pending changes must not be lost when the process exits normally
+atexit.register(flush)
+
+
+def batch():
+    """ Context manager persisting the save() and remove() calls made in
+    it together when it exits, e.g. one file rewrite per class
+    """
+    return storage.batch()
 
 
 class Base():
     """ Base class
     """
 
+    # Slots instead of a per-instance __dict__ keep loaded objects small;
+    # subclasses declare their own attributes the same way
+    __slots__ = ('id', 'created_at', 'updated_at', '_cache')
+
+    # Attributes with a hash index, used by search() for exact matches
+    INDEXED_ATTRIBUTES = ()
+    # String or timestamp attributes with a sorted index, used by
+    # search() for models.query conditions (Range, Prefix, Domain, In)
+    SORTED_ATTRIBUTES = ('created_at', 'updated_at')
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
-        s_class = str(self.__class__.__name__)
-        if DATA.get(s_class) is None:
-            DATA[s_class] = {}
-
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = parse_timestamp(kwargs.get('created_at'))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = parse_timestamp(kwargs.get('updated_at'))
         else:
             self.updated_at = datetime.utcnow()
 
@@ -48,90 +107,148 @@ class Base():
         """ Convert the object a JSON dictionary
         """
         result = {}
-        for key, value in self.__dict__.items():
+        for key, value in self._attributes():
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
-                result[key] = value.strftime(TIMESTAMP_FORMAT)
+                result[key] = format_timestamp(value)
             else:
                 result[key] = value
         return result
 
+    def to_json_text(self) -> str:
+        """ to_json() as compact JSON text with sorted keys, the way
+        the API renders it
+
+        The text is cached along with the attribute values it was built
+        from, and built again once any of them was replaced.
+        """
+        values = tuple(getattr(self, name, _UNSET)
+                       for name in self._slot_names())
+        if hasattr(self, '__dict__'):
+            values += tuple(self.__dict__.items())
+        cache = getattr(self, '_cache', None)
+        if cache is not None and cache[0] == values:
+            return cache[1]
+        text = json.dumps(self.to_json(), sort_keys=True,
+                          separators=(",", ":"))
+        self._cache = (values, text)
+        return text
+
+    @classmethod
+    def _slot_names(cls) -> Tuple[str, ...]:
+        """ Slot attributes of the class, base classes first
+        """
+        names = _SLOT_NAMES.get(cls)
+        if names is None:
+            names = []
+            for klass in reversed(cls.__mro__):
+                slots = klass.__dict__.get('__slots__', ())
+                if isinstance(slots, str):
+                    slots = (slots,)
+                names.extend(name for name in slots
+                             if name not in ('__dict__', '__weakref__') and
+                             name not in _CACHE_SLOTS)
+            names = _SLOT_NAMES[cls] = tuple(names)
+        return names
+
+    def _attributes(self) -> Iterator[Tuple[str, object]]:
+        """ (name, value) of every attribute set on the instance
+        """
+        for name in self._slot_names():
+            value = getattr(self, name, _UNSET)
+            if value is not _UNSET:
+                yield name, value
+        # Subclasses without __slots__ still get a __dict__
+        yield from getattr(self, '__dict__', {}).items()
+
     @classmethod
     def load_from_file(cls):
         """ Load all objects from file
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
-
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+        storage.load(cls)
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
         """
-        s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
-
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+        storage.save_all(cls)
 
     def save(self):
         """ Save current object
         """
-        s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        storage.upsert(self)
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        storage.delete(self)
+
+    @classmethod
+    def save_many(cls, objs: Iterable[TypeVar('Base')]):
+        """ Save several objects, persisting them once
+        """
+        objs = list(objs)
+        now = datetime.utcnow()
+        for obj in objs:
+            obj.updated_at = now
+        storage.upsert_many(objs)
+
+    @classmethod
+    def remove_many(cls, objs: Iterable[TypeVar('Base')]):
+        """ Remove several objects, persisting the removals once
+        """
+        # Materialized first, as objs may be a lazy search of the store
+        storage.delete_many(list(objs))
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
-        s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        return storage.count(cls)
 
     @classmethod
-    def all(cls) -> Iterable[TypeVar('Base')]:
+    def all(cls, limit: int = None, offset: int = 0,
+            after: str = None) -> Iterable[TypeVar('Base')]:
         """ Return all objects
         """
-        return cls.search()
+        return cls.search({}, limit, offset, after)
 
     @classmethod
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
-        s_class = cls.__name__
-        return DATA[s_class].get(id)
+        return storage.get(cls, id)
 
     @classmethod
-    def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
+    def search(cls, attributes: dict = {}, limit: int = None,
+               offset: int = 0, after: str = None) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
+
+        Values are either compared for equality or are models.query
+        conditions such as Range or Prefix. Pages (limit, offset or
+        after) are ordered by id; after is the id of the last object of
+        the previous page.
+        """
+        if limit is None and not offset and after is None:
+            return storage.search(cls, attributes)
+        return list(cls.iter_search(attributes, limit, offset, after))
+
+    @classmethod
+    def iter_search(cls, attributes: dict = {}, limit: int = None,
+                    offset: int = 0,
+                    after: str = None) -> Iterator[TypeVar('Base')]:
+        """ Lazily yield objects with matching attributes, so callers
+        that stop early do not pay for the whole class
+        """
+        paged = limit is not None or offset or after is not None
+        matches = storage.iter_search(cls, attributes, after, bool(paged))
+        stop = None if limit is None else offset + limit
+        return islice(matches, offset, stop)
+
+    @classmethod
+    def first(cls, attributes: dict = {}) -> TypeVar('Base'):
+        """ Return the first object with matching attributes, or None
         """
-        s_class = cls.__name__
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
-            return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+        return next(cls.iter_search(attributes), None)
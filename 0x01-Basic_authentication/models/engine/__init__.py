@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+""" Storage engines of the models
+"""
+from os import getenv
+from models.engine.storage import Storage
+
+
+def make_storage() -> Storage:
+    """ Build the storage engine selected by STORAGE_ENGINE
+    """
+    engine = getenv("STORAGE_ENGINE", "file")
+    if engine == "sqlite":
+        from models.engine.sqlite_storage import SQLiteStorage
+        return SQLiteStorage(getenv("STORAGE_SQLITE_PATH", ".db.sqlite3"))
+    if engine != "file":
+        raise ValueError("Unknown STORAGE_ENGINE: {}".format(engine))
+    from models.engine.file_storage import FileStorage
+    return FileStorage()
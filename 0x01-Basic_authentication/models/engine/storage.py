@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+""" Storage engine interface
+"""
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, TypeVar
+
+
+class Storage():
+    """ Interface every storage engine implements
+
+    Methods receive the model class (or instance) they act on, so one
+    engine serves every model.
+    """
+
+    def load(self, cls: type):
+        """ (Re)load all objects of a class from the backing store
+        """
+        raise NotImplementedError()
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID, or None
+        """
+        raise NotImplementedError()
+
+    def iter_search(self, cls: type, attributes: dict, after: str = None,
+                    ordered: bool = False) -> Iterator[TypeVar('Base')]:
+        """ Lazily yield the objects whose attributes equal the given
+        values, in storage order or, when ordered or after is given, in
+        id order starting after that id
+        """
+        raise NotImplementedError()
+
+    def search(self, cls: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Return all objects whose attributes equal the given values
+        """
+        return list(self.iter_search(cls, attributes))
+
+    def upsert(self, obj: TypeVar('Base')):
+        """ Insert or update one object
+        """
+        raise NotImplementedError()
+
+    def delete(self, obj: TypeVar('Base')):
+        """ Delete one object
+        """
+        raise NotImplementedError()
+
+    def upsert_many(self, objs: Iterable[TypeVar('Base')]):
+        """ Insert or update several objects, persisting them once
+        """
+        with self.batch():
+            for obj in objs:
+                self.upsert(obj)
+
+    def delete_many(self, objs: Iterable[TypeVar('Base')]):
+        """ Delete several objects, persisting the deletions once
+        """
+        with self.batch():
+            for obj in objs:
+                self.delete(obj)
+
+    @contextmanager
+    def batch(self):
+        """ Persist the writes made by this thread in the block together
+        when it exits; blocks can be nested
+        """
+        yield
+
+    def count(self, cls: type) -> int:
+        """ Number of objects of a class
+        """
+        raise NotImplementedError()
+
+    def save_all(self, cls: type):
+        """ Write every object of a class to the backing store
+        """
+
+    def flush(self, cls: type = None):
+        """ Write pending changes of one class, or of all classes
+        """
@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 """ User module
 """
-import hashlib
 from models.base import Base
+from models.password import hash_password, pool, verify_and_upgrade
 
 
 class User(Base):
     """ User class
     """
 
+    __slots__ = ('email', '_password', 'first_name', 'last_name')
+
+    INDEXED_ATTRIBUTES = ('email',)
+    SORTED_ATTRIBUTES = Base.SORTED_ATTRIBUTES + ('email',)
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
         """
@@ -26,22 +31,30 @@ class User(Base):
 
     @password.setter
     def password(self, pwd: str):
-        """ Setter of a new password: encrypt in SHA256
+        """ Setter of a new password: hashed with salted scrypt on the
+        password pool
         """
         if pwd is None or type(pwd) is not str:
             self._password = None
         else:
-            self._password = hashlib.sha256(pwd.encode()).hexdigest().lower()
+            self._password = pool.run("hash", hash_password, pwd)
 
     def is_valid_password(self, pwd: str) -> bool:
-        """ Validate a password
+        """ Validate a password on the password pool
+
+        A valid password stored with an outdated hash, such as the
+        former unsalted SHA-256, is hashed again and saved.
         """
         if pwd is None or type(pwd) is not str:
             return False
-        if self.password is None:
+        stored = self.password
+        if stored is None:
             return False
-        pwd_e = pwd.encode()
-        return hashlib.sha256(pwd_e).hexdigest().lower() == self.password
+        valid, new_hash = pool.run("verify", verify_and_upgrade, stored, pwd)
+        if new_hash is not None:
+            self._password = new_hash
+            self.save()
+        return valid
 
     def display_name(self) -> str:
         """ Display User name based on email/first_name/last_name
@@ -10,6 +10,7 @@ from api.v1.auth.session_db_auth import SessionDBAuth
 from api.v1.views import app_views
 from flask import Flask, jsonify, abort, request
 from flask_cors import CORS
+from models.password import PasswordPoolFull
 from os import getenv
 
 
@@ -80,6 +81,13 @@ def forbidden(error) -> str:
     return jsonify({"error": "Forbidden"}), 403
 
 
+@app.errorhandler(PasswordPoolFull)
+def password_pool_full(error) -> str:
+    """ Password pool saturated: credentials could not be checked
+    """
+    return jsonify({"error": "too many login attempts"}), 503
+
+
 if __name__ == "__main__":
     host = getenv("API_HOST", "0.0.0.0")
     port = getenv("API_PORT", "5000")
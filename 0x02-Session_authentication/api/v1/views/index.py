@@ -26,6 +26,17 @@ def stats() -> str:
     return jsonify(stats)
 
 
+@app_views.route('/stats/passwords', strict_slashes=False)
+def password_stats() -> str:
+    """ GET /api/v1/stats/passwords
+    Return:
+      - load of the password hashing pool, with the queue wait and
+        latency in milliseconds of its hash and verify operations
+    """
+    from models.password import pool
+    return jsonify(pool.metrics())
+
+
 @app_views.route('/unauthorized', methods=['GET'], strict_slashes=False)
 def unauthorized() -> None:
     """ GET /api/v1/unauthorized
@@ -3,6 +3,7 @@
 Module for session authentication views
 """
 from flask import Blueprint, jsonify, request, make_response
+from models.password import PasswordPoolFull
 from models.user import User
 import os
 
@@ -24,13 +25,15 @@ def login():
     if not password:
         return jsonify({"error": "password missing"}), 400
 
-    users = User.search({'email': email})
-    if not users:
+    user = User.first({'email': email})
+    if user is None:
         return jsonify({"error": "no user found for this email"}), 404
 
-    user = users[0]
-
-    if not user.is_valid_password(password):
+    try:
+        valid = user.is_valid_password(password)
+    except PasswordPoolFull:
+        return jsonify({"error": "too many login attempts"}), 503
+    if not valid:
         return jsonify({"error": "wrong password"}), 401
 
     # Import auth dynamically to avoid circular imports
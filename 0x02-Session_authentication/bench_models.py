@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+""" Benchmarks of the model layer
+Usage: ./bench_models.py <benchmark> [count]
+"""
+from datetime import datetime, timedelta
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+
+import models.base
+from models.listing import JsonListing
+from models.query import Domain, In, Prefix, Range, matches
+from models.user import User
+from models.user_session import UserSession
+
+
+def bytes_per_object(factory, count: int) -> float:
+    """ Average bytes allocated per object built by factory
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = [factory(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objs
+    return (after - before) / count
+
+
+def bench_memory(count: int):
+    """ Bytes per User and UserSession instance, as loaded from file
+    """
+    def make_user(i):
+        return User(id=str(uuid.uuid4()), email="user{}@example.com".format(i),
+                    _password="0" * 64, first_name="First", last_name="Last",
+                    created_at="2024-01-01T00:00:00",
+                    updated_at="2024-01-01T00:00:00")
+
+    def make_session(i):
+        return UserSession(id=str(uuid.uuid4()), user_id=str(uuid.uuid4()),
+                           session_id=str(uuid.uuid4()),
+                           created_at="2024-01-01T00:00:00",
+                           updated_at="2024-01-01T00:00:00")
+
+    for name, factory in (("User", make_user), ("UserSession", make_session)):
+        print("{:<12} {:>8.0f} bytes/object".format(
+            name, bytes_per_object(factory, count)))
+
+
+def timed(func) -> float:
+    """ Seconds taken by func()
+    """
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def bench_load(count: int):
+    """ load_from_file plus first access, and the view_all_users payload
+    """
+    os.chdir(tempfile.mkdtemp())
+    users = [User(email="user{}@example.com".format(i)) for i in range(count)]
+    with open(".db_User.json", "w") as f:
+        json.dump({user.id: user.to_json(True) for user in users}, f)
+    del users
+
+    def listing():
+        json.dumps([user.to_json() for user in User.all()])
+
+    cached = JsonListing()
+    print("load_from_file + all  {:>8.3f}s".format(
+        timed(lambda: (User.load_from_file(), User.all()))))
+    print("view_all_users        {:>8.3f}s".format(timed(listing)))
+    print("cached listing, cold  {:>8.3f}s".format(
+        timed(lambda: cached.render(User.all()))))
+    print("cached listing, warm  {:>8.3f}s".format(
+        timed(lambda: cached.render(User.all()))))
+
+
+def run_threads(count: int, target, seconds: float) -> list:
+    """ Run target(stop, errors) in count threads for some seconds and
+    return the exceptions they raised
+    """
+    stop = threading.Event()
+    errors = []
+    threads = [threading.Thread(target=target, args=(stop, errors))
+               for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def guarded(func):
+    """ Thread body calling func() until stopped, recording any error
+    """
+    def body(stop, errors):
+        while not stop.is_set():
+            try:
+                func()
+            except Exception as e:
+                errors.append(e)
+                return
+    return body
+
+
+def bench_stress(count: int):
+    """ Concurrent saves, removes, reads, scans and snapshots, then
+    check that memory and the reloaded file agree
+    """
+    os.chdir(tempfile.mkdtemp())
+    emails = ["user{}@example.com".format(i) for i in range(count)]
+    for email in emails:
+        User(email=email).save()
+
+    def write():
+        user = User.first({"email": random.choice(emails)})
+        if user is not None and random.random() < 0.3:
+            user.remove()
+            User(email=user.email).save()
+        elif user is not None:
+            user.first_name = str(random.random())
+            user.save()
+
+    def read():
+        User.search({"email": random.choice(emails)})
+        User.get(random.choice(emails))
+        after = None
+        while True:
+            page = User.all(limit=50, after=after)
+            if not page:
+                break
+            after = page[-1].id
+
+    errors = run_threads(4, guarded(write), 3.0)
+    errors += run_threads(4, guarded(read), 3.0)
+    errors += run_threads(8, guarded(
+        lambda: (write(), read(), User.save_to_file())), 3.0)
+    models.base.flush()
+    in_memory = sorted(u.id for u in User.all())
+    ids = [u.id for u in User.all(limit=count * 2)]
+    User.load_from_file()
+    on_disk = sorted(u.id for u in User.all())
+    print("errors          {}".format(len(errors)))
+    for error in errors[:5]:
+        print("  {!r}".format(error))
+    print("objects         {}".format(len(in_memory)))
+    print("pages ordered   {}".format(ids == sorted(ids)))
+    print("file == memory  {}".format(in_memory == on_disk))
+    if errors or in_memory != on_disk or ids != sorted(ids):
+        sys.exit(1)
+
+
+def bench_readers(count: int):
+    """ Read throughput by number of reader threads, alone and next to
+    one thread saving continuously
+    """
+    os.chdir(tempfile.mkdtemp())
+    users = [User(email="user{}@example.com".format(i))
+             for i in range(count)]
+    for user in users:
+        models.base.storage.upsert(user)
+    User.save_to_file()
+    ids = [user.id for user in users]
+    del users
+
+    def read():
+        User.search({"email": "user{}@example.com".format(
+            random.randrange(count))})
+        User.all(limit=20, after=random.choice(ids))
+
+    def write():
+        User.get(random.choice(ids)).save()
+
+    print("{:>8} {:>14} {:>14}".format(
+        "readers", "reads/s", "with writer"))
+    for readers in (1, 2, 4, 8):
+        results = []
+        for writers in (0, 1):
+            done = [0] * readers
+            stop = threading.Event()
+
+            def reader(slot):
+                while not stop.is_set():
+                    read()
+                    done[slot] += 1
+            threads = [threading.Thread(target=reader, args=(i,))
+                       for i in range(readers)]
+            threads += [threading.Thread(target=guarded(write),
+                                         args=(stop, []))
+                        for _ in range(writers)]
+            for thread in threads:
+                thread.start()
+            time.sleep(2.0)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            results.append(sum(done) / 2.0)
+        print("{:>8} {:>14.0f} {:>14.0f}".format(readers, *results))
+
+
+def bench_sync(count: int):
+    """ With STORAGE_SYNC=1: how long a user saved by one process stays
+    invisible to another, and what the change checks add to each read
+    """
+    os.chdir(tempfile.mkdtemp())
+    User.load_from_file()
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+
+    def writer():
+        for i in range(count):
+            user = User(email="user{}@example.com".format(i))
+            user.save()
+            queue.put((user.id, time.perf_counter()))
+            time.sleep(0.002)
+        queue.put(None)
+
+    process = context.Process(target=writer)
+    process.start()
+    delays = []
+    missed = 0
+    for obj_id, saved_at in iter(queue.get, None):
+        while User.get(obj_id) is None:
+            if time.perf_counter() - saved_at > 1.0:
+                missed += 1
+                break
+        else:
+            delays.append(time.perf_counter() - saved_at)
+    process.join()
+    delays.sort()
+    if delays:
+        print("staleness median {:>8.3f}ms  p99 {:.3f}ms  max {:.3f}ms"
+              .format(delays[len(delays) // 2] * 1e3,
+                      delays[int(len(delays) * 0.99)] * 1e3,
+                      delays[-1] * 1e3))
+    print("not seen within 1s  {}".format(missed))
+    print("visible             {}/{}".format(User.count(), count))
+    obj_id = User.all()[-1].id if User.count() else "none"
+    calls = 20000
+    print("get                 {:>8.2f}us".format(timed(
+        lambda: [User.get(obj_id) for _ in range(calls)]) / calls * 1e6))
+    print("search by email     {:>8.2f}us".format(timed(
+        lambda: [User.search({"email": "user1@example.com"})
+                 for _ in range(calls)]) / calls * 1e6))
+
+
+def bench_query(count: int):
+    """ Range, prefix, domain and in searches against a full scan
+    """
+    os.chdir(tempfile.mkdtemp())
+    start = datetime(2024, 1, 1)
+    for i in range(count):
+        models.base.storage.upsert(User(
+            email="user{}@example{}.com".format(i, i % 100),
+            created_at=(start + timedelta(seconds=i)).isoformat()))
+    User.save_to_file()
+    User.load_from_file()
+    everyone = User.all()
+    queries = {
+        "created_at range": {"created_at": Range(
+            start + timedelta(seconds=count // 2),
+            start + timedelta(seconds=count // 2 + 100))},
+        "email prefix": {"email": Prefix("user1234")},
+        "email domain": {"email": Domain("example7.com")},
+        "email in": {"email": In(["user{}@example{}.com".format(i, i % 100)
+                                  for i in range(0, count, count // 10)])},
+    }
+    calls = 20
+    print("{:<18} {:>8} {:>12} {:>12}".format(
+        "query", "matches", "indexed", "scan"))
+    for name, query in queries.items():
+        found = len(User.search(query))
+
+        def scan():
+            return [u for u in everyone if all(
+                matches(getattr(u, k), v) for k, v in query.items())]
+        print("{:<18} {:>8} {:>10.3f}ms {:>10.3f}ms".format(
+            name, found,
+            timed(lambda: [User.search(query) for _ in range(calls)])
+            / calls * 1e3,
+            timed(lambda: [scan() for _ in range(calls)]) / calls * 1e3))
+
+
+def bench_bulk(count: int):
+    """ Saving then removing users one by one, in a batch and in bulk
+    """
+    os.chdir(tempfile.mkdtemp())
+
+    def one_by_one(users):
+        for user in users:
+            user.save()
+        for user in users:
+            user.remove()
+
+    def batched(users):
+        with models.base.batch():
+            for user in users:
+                user.save()
+        with models.base.batch():
+            for user in users:
+                user.remove()
+
+    def bulk(users):
+        User.save_many(users)
+        User.remove_many(users)
+
+    for name, run in (("one by one", one_by_one), ("batch", batched),
+                      ("save_many/remove_many", bulk)):
+        users = [User(email="user{}@example.com".format(i))
+                 for i in range(count)]
+        print("{:<22} {:>8.3f}s".format(name, timed(lambda: run(users))))
+
+
+def bench_shards(count: int):
+    """ With STORAGE_SHARDS=n: cost and bytes written of single saves in
+    a class of count users, and of loading it
+    """
+    os.chdir(tempfile.mkdtemp())
+    User.save_many(User(email="user{}@example.com".format(i))
+                   for i in range(count))
+    users = User.all()
+    paths = models.base.storage.snapshot_paths(User)
+    calls = 50
+    written = 0
+
+    def update():
+        nonlocal written
+        for user in random.sample(users, calls):
+            user.first_name = "first"
+            user.save()
+            # The save rewrote the newest file
+            written += max((os.stat(p) for p in paths if os.path.exists(p)),
+                           key=lambda st: st.st_mtime_ns).st_size
+
+    print("save                {:>8.3f}ms".format(timed(update) / calls * 1e3))
+    print("written per save    {:>8.0f}KB".format(written / calls / 1024))
+    print("load_from_file + all  {:>6.3f}s".format(
+        timed(lambda: (User.load_from_file(), User.all()))))
+
+
+BENCHMARKS = {
+    "memory": bench_memory,
+    "load": bench_load,
+    "stress": bench_stress,
+    "readers": bench_readers,
+    "sync": bench_sync,
+    "query": bench_query,
+    "bulk": bench_bulk,
+    "shards": bench_shards,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Usage: {} <{}> [count]".format(
+            sys.argv[0], "|".join(BENCHMARKS)))
+        sys.exit(1)
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    BENCHMARKS[sys.argv[1]](count)
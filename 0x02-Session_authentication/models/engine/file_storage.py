@@ -0,0 +1,1008 @@
+#!/usr/bin/env python3
+""" JSON file storage engine
+"""
+from bisect import bisect_left, bisect_right, insort
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+from typing import List, Iterator, Tuple, TypeVar, Union
+from os import getenv, path
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+
+from models.engine.rwlock import RWLock
+from models.engine.storage import Storage
+from models.query import Condition, In, Prefix, Range, Suffix, matches, \
+    sort_key
+
+
+# Journal mode appends one record per mutation instead of rewriting
+# the whole class file; the journal is folded into the snapshot once it
+# grows past STORAGE_COMPACT_THRESHOLD records
+JOURNAL = getenv("STORAGE_JOURNAL", "0").lower() in ("1", "true", "yes")
+COMPACT_THRESHOLD = int(getenv("STORAGE_COMPACT_THRESHOLD", 1000))
+
+# Write-behind mode only marks classes dirty on mutation; a background
+# thread rewrites their files every STORAGE_FLUSH_INTERVAL seconds, or
+# sooner once STORAGE_FLUSH_BATCH mutations are pending
+WRITE_BEHIND = getenv("STORAGE_WRITE_BEHIND", "0").lower() in \
+    ("1", "true", "yes")
+FLUSH_INTERVAL = float(getenv("STORAGE_FLUSH_INTERVAL", 1.0))
+FLUSH_BATCH = int(getenv("STORAGE_FLUSH_BATCH", 100))
+
+# "jsonl" stores one object per line in .db_<Class>.jsonl so the file
+# can be parsed incrementally; "json" keeps the single JSON document
+STORAGE_FORMAT = getenv("STORAGE_FORMAT", "json")
+
+# Sharded layout splits the snapshot of each class into STORAGE_SHARDS
+# files .db_<Class>.<shard>.json by a hash of the id, so a rewrite only
+# covers the shard of the changed objects; 0 or 1 keeps a single file
+SHARDS = max(int(getenv("STORAGE_SHARDS", 0)), 1)
+
+# Sync mode lets several processes share the files: reads check them
+# for changes made elsewhere at most every STORAGE_SYNC_INTERVAL seconds,
+# applying new journal records incrementally and reloading a class only
+# when its snapshot was rewritten. Write-behind keeps unwritten changes
+# in memory, so it cannot be shared and ignores this setting
+SYNC = getenv("STORAGE_SYNC", "0").lower() in ("1", "true", "yes") and \
+    not WRITE_BEHIND
+SYNC_INTERVAL = float(getenv("STORAGE_SYNC_INTERVAL", 0))
+
+# Most ids copied per read-locked step of an ordered scan
+SCAN_CHUNK = 1024
+
+_UNINDEXED = object()
+
+logger = logging.getLogger(__name__)
+
+
+def _is_raw(entry) -> bool:
+    """ True for entries loaded from file but not built into objects yet
+    """
+    return type(entry) is dict or type(entry) is str
+
+
+def _shard(obj_id: str) -> int:
+    """ Shard of an id; crc32 rather than hash() so every process agrees
+    """
+    return zlib.crc32(obj_id.encode()) % SHARDS
+
+
+def _shards_of(obj_id: str) -> set:
+    """ Shards to rewrite after a change to an object, None for all
+    """
+    return None if SHARDS == 1 else {_shard(obj_id)}
+
+
+def _merge_shards(shards: set, other: set) -> set:
+    """ Union of two shard sets, where None stands for every shard
+    """
+    if shards is None or other is None:
+        return None
+    return shards | other
+
+
+def _matches(obj: TypeVar('Base'), attributes: dict) -> bool:
+    """ True if every attribute of obj equals the given value
+    """
+    for k, v in attributes.items():
+        if not matches(getattr(obj, k), v):
+            return False
+    return True
+
+
+def _signature(file_path: str) -> Tuple[int, int, int]:
+    """ Identity of a file version: inode, size and modification time,
+    or None when the file does not exist
+    """
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _entry_key(entry: Union[TypeVar('Base'), dict, str], k: str,
+               reverse: bool, record: dict = None) -> str:
+    """ Sorted index key of attribute k of a stored entry, reversed for
+    suffix lookups; record holds the fields of a raw entry when known
+    """
+    if record is None and _is_raw(entry):
+        record = json.loads(entry) if type(entry) is str else entry
+    value = record.get(k) if record is not None else getattr(entry, k, None)
+    key = sort_key(value)
+    if key is not None and reverse:
+        key = key[::-1]
+    return key
+
+
+def _to_record(obj: Union[TypeVar('Base'), dict, str]) -> dict:
+    """ JSON record of a stored entry; raw records are written back as-is
+    """
+    if type(obj) is str:
+        return json.loads(obj)
+    return obj if type(obj) is dict else obj.to_json(True)
+
+
+class FileStorage(Storage):
+    """ Keeps every object in memory and persists each class to
+    .db_<Class>.json, or to one file per shard
+
+    Each class has a readers/writer lock: mutations hold it as writers
+    while reads and file snapshots share it, and a separate file lock
+    keeps two snapshots of one class from writing at the same time.
+    In sync mode an flock on .db_<Class>.lock also orders the writes of
+    different processes; it is always taken before the other locks.
+    """
+
+    def __init__(self):
+        """ Initialize an empty storage
+        """
+        # class name -> id -> object, or its raw record until first use
+        self.data = {}
+        # Secondary indexes: class name -> attribute -> value -> {id: obj}
+        self.indexes = {}
+        # Indexed values each object was stored under, in
+        # INDEXED_ATTRIBUTES order: class name -> id -> values
+        self._indexed_values = {}
+        # Sorted ids of each class, used for ordered iteration; None
+        # until first needed after a load
+        self._sorted_ids = {}
+        # Sorted indexes, built on first use: class name ->
+        # (attribute, reversed) -> ([(key, id)] in order, {id: key})
+        self._sorted_indexes = {}
+        # Ids of each shard in insertion order, when sharded: class
+        # name -> shard -> {id: None}
+        self._shard_ids = {}
+        self._locks = {}
+        self._file_locks = {}
+        self._journal_sizes = {}
+        # Version of the files each class was last synchronized with:
+        # class name -> {"snapshot", "journal", "offset", "checked"}
+        self._file_state = {}
+        self._held = threading.local()
+        self._compacting = set()
+        self._dirty = {}
+        self._dirty_lock = threading.Lock()
+        self._flush_wakeup = threading.Event()
+        self._flusher = None
+
+    def _lock(self, s_class: str) -> RWLock:
+        """ Readers/writer lock guarding the objects of one class
+        """
+        lock = self._locks.get(s_class)
+        if lock is None:
+            lock = self._locks.setdefault(s_class, RWLock())
+        return lock
+
+    def _file_lock(self, s_class: str) -> threading.Lock:
+        """ Lock serializing the file writes of one class
+        """
+        return self._file_locks.setdefault(s_class, threading.Lock())
+
+    @contextmanager
+    def _process_lock(self, cls: type, exclusive: bool = False):
+        """ Hold the cross-process lock of a class in sync mode; nested
+        calls in one thread reuse the outermost hold
+        """
+        held = getattr(self._held, "classes", None)
+        if held is None:
+            held = self._held.classes = set()
+        s_class = cls.__name__
+        if not SYNC or s_class in held:
+            yield
+            return
+        with open(".db_{}.lock".format(s_class), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            held.add(s_class)
+            try:
+                yield
+            finally:
+                held.discard(s_class)
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _objects(self, cls: type) -> dict:
+        """ Stored entries of a class
+        """
+        return self.data.setdefault(cls.__name__, {})
+
+    def _shard_members(self, s_class: str) -> List[dict]:
+        """ Ids of each shard of a class
+        """
+        members = self._shard_ids.get(s_class)
+        if members is None:
+            members = self._shard_ids[s_class] = [{} for _ in range(SHARDS)]
+        return members
+
+    def file_path(self, cls: type, shard: int = None) -> str:
+        """ Path of the unsharded snapshot file, or of one shard
+        """
+        extension = "jsonl" if STORAGE_FORMAT == "jsonl" else "json"
+        if shard is None:
+            return ".db_{}.{}".format(cls.__name__, extension)
+        return ".db_{}.{}.{}".format(cls.__name__, shard, extension)
+
+    def snapshot_paths(self, cls: type) -> List[str]:
+        """ Paths of the snapshot files of a class
+        """
+        if SHARDS == 1:
+            return [self.file_path(cls)]
+        return [self.file_path(cls, i) for i in range(SHARDS)]
+
+    def _snapshot_files(self, cls: type) -> List[Tuple[str, str, int]]:
+        """ (path, format, shard) of every snapshot file of a class in
+        any format and shard count; shard is None for unsharded files
+        """
+        pattern = re.compile(r"\.db_{}(?:\.(\d+))?\.(json|jsonl)$".format(
+            re.escape(cls.__name__)))
+        files = []
+        for name in sorted(os.listdir(".")):
+            match = pattern.match(name)
+            if match:
+                shard = match.group(1)
+                files.append((name, match.group(2),
+                              None if shard is None else int(shard)))
+        return files
+
+    def _snapshot_signature(self, cls: type) -> tuple:
+        """ Signatures of the snapshot files of a class
+        """
+        return tuple(_signature(p) for p in self.snapshot_paths(cls))
+
+    def journal_path(self, cls: type) -> str:
+        """ Path of the journal file
+        """
+        return ".db_{}.journal".format(cls.__name__)
+
+    def load(self, cls: type):
+        """ Load all objects from file
+        """
+        s_class = cls.__name__
+        with self._process_lock(cls), self._lock(s_class).write():
+            # Reloading must not drop changes still waiting to be written
+            self.flush(cls)
+            self.data[s_class] = {}
+            self.indexes[s_class] = {k: {} for k in cls.INDEXED_ATTRIBUTES}
+            self._indexed_values[s_class] = {}
+            self._sorted_ids[s_class] = None
+            self._sorted_indexes[s_class] = {}
+            self._shard_ids.pop(s_class, None)
+            # Files of another format or shard count, left by an earlier
+            # configuration or a conversion cut short, are read first so
+            # the current files win for the objects found in both
+            current = set(self.snapshot_paths(cls))
+            files = self._snapshot_files(cls)
+            stale = [f for f in files if f[0] not in current]
+            files = stale + [f for f in files if f[0] in current]
+            rewrite = bool(stale)
+            state = {"snapshot": self._snapshot_signature(cls),
+                     "journal": None, "offset": 0,
+                     "checked": time.monotonic()}
+            # Records stay raw until they are first accessed
+            for entry, obj_json, shard in self._read_snapshot(files):
+                self._store(cls, entry, obj_json)
+                if not rewrite and shard is not None and \
+                        shard != _shard(obj_json["id"]):
+                    # Written with another shard count: a rewrite of
+                    # its new shard would leave this copy behind
+                    rewrite = True
+            self._journal_sizes[s_class] = 0
+            # A journal left from a run with STORAGE_JOURNAL=1 holds the
+            # latest changes; without the journal mode it is folded into
+            # the snapshot, then removed so it is never replayed over
+            # newer snapshots
+            folded = not JOURNAL and path.exists(self.journal_path(cls))
+            if JOURNAL or folded:
+                state["journal"], state["offset"] = self._apply_journal(cls)
+            if folded:
+                state["journal"], state["offset"] = None, 0
+                rewrite = True
+            self._file_state[s_class] = state
+            if rewrite:
+                # Everything is moved to the current layout, and the
+                # other files are removed so they are never read again
+                with self._file_lock(s_class):
+                    self._write_snapshot(cls)
+                removed = [file_path for file_path, _, _ in stale]
+                if folded:
+                    removed.append(self.journal_path(cls))
+                for file_path in removed:
+                    try:
+                        os.remove(file_path)
+                    except FileNotFoundError:
+                        pass
+
+    def _read_snapshot(
+        self, files: List[Tuple[str, str, int]]
+    ) -> Iterator[Tuple[Union[str, dict], dict, int]]:
+        """ Yield (entry, record, shard) from snapshot files given as
+        (path, format, shard), in order, where entry is what is kept
+        until the object is first accessed
+        """
+        if len(files) <= 1:
+            # A single file is streamed
+            for f in files:
+                yield from self._read_file(*f)
+            return
+        # Shards are read side by side, and yielded in order
+        workers = min(len(files), os.cpu_count() or 1)
+        with ThreadPoolExecutor(workers) as executor:
+            for entries in executor.map(
+                    lambda f: list(self._read_file(*f)), files):
+                yield from entries
+
+    @staticmethod
+    def _read_file(
+        file_path: str, file_format: str, shard: int
+    ) -> Iterator[Tuple[Union[str, dict], dict, int]]:
+        """ Yield (entry, record, shard) from one snapshot file
+        """
+        if not path.exists(file_path):
+            return
+        with open(file_path, 'r') as f:
+            if file_format == "jsonl":
+                # The line itself is kept: it is far smaller than the
+                # parsed dict and is written back as-is
+                for line in f:
+                    line = line.rstrip("\n")
+                    if line:
+                        yield line, json.loads(line), shard
+            else:
+                for obj_json in json.load(f).values():
+                    yield obj_json, obj_json, shard
+
+    def _apply_journal(self, cls: type, offset: int = 0) -> Tuple[int, int]:
+        """ Apply the journal records from a byte offset on top of the
+        stored objects, and return the journal inode and the offset
+        following the last complete record
+        """
+        s_class = cls.__name__
+        try:
+            f = open(self.journal_path(cls), 'rb')
+        except FileNotFoundError:
+            return None, 0
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            f.seek(offset)
+            data = f.read()
+        # A last line without newline is still being written, or was
+        # cut by a crash; it is read again on the next call
+        end = data.rfind(b"\n") + 1
+        count = 0
+        with self._lock(s_class).write():
+            for line in data[:end].splitlines():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("op") == "save":
+                    self._store(cls, record["obj"])
+                elif record.get("op") == "remove":
+                    self._discard(cls, record["id"])
+                else:
+                    continue
+                count += 1
+            self._journal_sizes[s_class] = \
+                self._journal_sizes.get(s_class, 0) + count
+        return inode, offset + end
+
+    def refresh(self, cls: type, force: bool = False):
+        """ Apply the changes other processes made to the files of a
+        class since it was loaded or last refreshed
+        """
+        s_class = cls.__name__
+        state = self._file_state.get(s_class)
+        if state is None:
+            # Never loaded: the files are the only up-to-date copy
+            self.load(cls)
+            return
+        now = time.monotonic()
+        if not force and now - state["checked"] < SYNC_INTERVAL:
+            return
+        state["checked"] = now
+        if self._unchanged(cls, state):
+            return
+        with self._process_lock(cls), self._lock(s_class).write():
+            if self._unchanged(cls, state):
+                return
+            if not JOURNAL or not self._follow_journal(cls, state):
+                self.load(cls)
+
+    def _unchanged(self, cls: type, state: dict) -> bool:
+        """ True if the files of a class are the versions last applied
+        """
+        if self._snapshot_signature(cls) != state["snapshot"]:
+            return False
+        if not JOURNAL:
+            return True
+        journal = _signature(self.journal_path(cls))
+        if journal is None:
+            return state["journal"] is None
+        return journal[:2] == (state["journal"], state["offset"])
+
+    def _follow_journal(self, cls: type, state: dict) -> bool:
+        """ Apply new journal records, and return False when the class
+        must be reloaded instead
+        """
+        s_class = cls.__name__
+        snapshot = self._snapshot_signature(cls)
+        journal = _signature(self.journal_path(cls))
+        if journal is None:
+            return False
+        if journal[0] != state["journal"]:
+            # A compaction replaced the journal; it starts with what it
+            # folded, and only that exact prefix lets the records follow
+            with open(self.journal_path(cls), 'rb') as f:
+                header = f.readline()
+            try:
+                folded = json.loads(header).get("folded")
+            except ValueError:
+                return False
+            if folded != [state["journal"], state["offset"]]:
+                return False
+            self._journal_sizes[s_class] = 0
+            state["snapshot"] = snapshot
+            state["offset"] = len(header)
+        elif snapshot != state["snapshot"] or journal[1] < state["offset"]:
+            return False
+        state["journal"], state["offset"] = \
+            self._apply_journal(cls, state["offset"])
+        return True
+
+    def _store(self, cls: type, obj: Union[TypeVar('Base'), dict, str],
+               record: dict = None):
+        """ Put an object in the storage and in the indexes
+
+        obj can also be a raw entry (a JSON record or line) not built
+        yet, in which case record holds its parsed fields.
+        """
+        s_class = cls.__name__
+        raw = _is_raw(obj)
+        if raw and record is None:
+            record = obj
+        obj_id = record["id"] if raw else obj.id
+        objects = self._objects(cls)
+        if obj_id in objects:
+            # Updated in place so the object keeps its position
+            self._unindex(cls, obj_id)
+        else:
+            ids = self._sorted_ids.get(s_class)
+            if ids is not None:
+                insort(ids, obj_id)
+            if SHARDS > 1:
+                self._shard_members(s_class)[_shard(obj_id)][obj_id] = None
+        objects[obj_id] = obj
+        for (k, reverse), (keys, by_id) in \
+                self._sorted_indexes.get(s_class, {}).items():
+            key = _entry_key(obj, k, reverse, record if raw else None)
+            if key is not None:
+                by_id[obj_id] = key
+                insort(keys, (key, obj_id))
+        if not cls.INDEXED_ATTRIBUTES:
+            return
+        indexes = self.indexes.setdefault(s_class, {})
+        values = []
+        for k in cls.INDEXED_ATTRIBUTES:
+            value = record.get(k) if raw else getattr(obj, k, None)
+            try:
+                bucket = indexes.setdefault(k, {}).setdefault(value, {})
+            except TypeError:
+                # Unhashable values can only match by a full scan
+                values.append(_UNINDEXED)
+                continue
+            bucket[obj_id] = obj
+            values.append(value)
+        self._indexed_values.setdefault(s_class, {})[obj_id] = tuple(values)
+
+    def _materialize(
+        self, cls: type, entry: Union[TypeVar('Base'), dict, str]
+    ) -> TypeVar('Base'):
+        """ Return the object for a stored entry, building it from its
+        raw record on first access
+        """
+        if not _is_raw(entry):
+            return entry
+        s_class = cls.__name__
+        record = json.loads(entry) if type(entry) is str else entry
+        obj_id = record["id"]
+        with self._lock(s_class).write():
+            # Another thread may have built it meanwhile
+            current = self._objects(cls).get(obj_id)
+            if current is not entry:
+                return self._materialize(cls, current)
+            obj = cls(**record)
+            self._objects(cls)[obj_id] = obj
+            indexes = self.indexes.get(s_class, {})
+            values = self._indexed_values.get(s_class, {}).get(obj_id, ())
+            for k, value in zip(cls.INDEXED_ATTRIBUTES, values):
+                if value is not _UNINDEXED:
+                    indexes[k][value][obj_id] = obj
+            return obj
+
+    def _discard(self, cls: type, obj_id: str):
+        """ Drop an object from the storage and from the indexes
+        """
+        s_class = cls.__name__
+        if self._objects(cls).pop(obj_id, None) is None:
+            return
+        ids = self._sorted_ids.get(s_class)
+        if ids is not None:
+            del ids[bisect_left(ids, obj_id)]
+        if SHARDS > 1:
+            self._shard_members(s_class)[_shard(obj_id)].pop(obj_id, None)
+        self._unindex(cls, obj_id)
+
+    def _unindex(self, cls: type, obj_id: str):
+        """ Drop an object from the indexes
+        """
+        s_class = cls.__name__
+        for keys, by_id in self._sorted_indexes.get(s_class, {}).values():
+            key = by_id.pop(obj_id, None)
+            if key is not None:
+                del keys[bisect_left(keys, (key, obj_id))]
+        values = self._indexed_values.get(s_class, {}).pop(obj_id, None)
+        if values is None:
+            return
+        # Objects can be mutated after being stored, so they are looked
+        # up under the values they were indexed with
+        for k, value in zip(cls.INDEXED_ATTRIBUTES, values):
+            if value is _UNINDEXED:
+                continue
+            bucket = self.indexes[s_class][k].get(value)
+            if bucket is not None:
+                bucket.pop(obj_id, None)
+                if not bucket:
+                    del self.indexes[s_class][k][value]
+
+    def save_all(self, cls: type, shards: set = None):
+        """ Save all objects to file, or only the given shards
+        """
+        s_class = cls.__name__
+        # Readers keep going while the snapshot is written
+        with self._lock(s_class).read(), self._file_lock(s_class):
+            self._write_snapshot(cls, shards)
+
+    def _write_snapshot(self, cls: type, shards: set = None):
+        """ Write the snapshot files, or only the given shards; writers
+        must be locked out
+        """
+        objects = self._objects(cls)
+        if SHARDS == 1:
+            self._write_file(self.file_path(cls), objects.items())
+        else:
+            members = self._shard_members(cls.__name__)
+            for i in range(SHARDS) if shards is None else sorted(shards):
+                self._write_file(self.file_path(cls, i), (
+                    (obj_id, objects[obj_id]) for obj_id in members[i]))
+        state = self._file_state.get(cls.__name__)
+        if state is not None:
+            # Our own write is not a change to apply
+            state["snapshot"] = self._snapshot_signature(cls)
+
+    @staticmethod
+    def _write_file(file_path: str, items: Iterator[Tuple[str, object]]):
+        """ Write (id, entry) pairs to one snapshot file
+        """
+        # Write then rename so readers never see a partial file; the
+        # name is per process so concurrent writers do not collide
+        tmp_path = "{}.{}.tmp".format(file_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            if STORAGE_FORMAT == "jsonl":
+                for _, obj in items:
+                    if type(obj) is not str:
+                        obj = json.dumps(_to_record(obj))
+                    f.write(obj + "\n")
+            else:
+                objs_json = {}
+                for obj_id, obj in items:
+                    objs_json[obj_id] = _to_record(obj)
+                json.dump(objs_json, f)
+        os.replace(tmp_path, file_path)
+
+    def _append_journal(self, cls: type, record: dict):
+        """ Append one mutation record to the journal
+        """
+        s_class = cls.__name__
+        line = (json.dumps(record) + "\n").encode()
+        with open(self.journal_path(cls), 'ab') as f:
+            f.write(line)
+            f.flush()
+            inode = os.fstat(f.fileno()).st_ino
+            end = f.tell()
+        state = self._file_state.get(s_class)
+        if state is not None and state["journal"] in (inode, None) and \
+                state["offset"] == end - len(line):
+            # Nothing was appended by others before this record, which
+            # is already applied here
+            state["journal"], state["offset"] = inode, end
+        self._journal_sizes[s_class] = self._journal_sizes.get(s_class, 0) + 1
+        if self._journal_sizes[s_class] >= COMPACT_THRESHOLD and \
+                s_class not in self._compacting:
+            self._compacting.add(s_class)
+            threading.Thread(
+                target=self.compact, args=(cls,), daemon=True
+            ).start()
+
+    def compact(self, cls: type):
+        """ Fold the journal into a new snapshot
+        """
+        s_class = cls.__name__
+        try:
+            with self._process_lock(cls, exclusive=True):
+                if SYNC:
+                    # Fold the records other processes appended too
+                    self.refresh(cls, force=True)
+                    if self._journal_sizes.get(s_class, 0) < \
+                            COMPACT_THRESHOLD:
+                        # Another process compacted meanwhile
+                        return
+                with self._lock(s_class).read(), self._file_lock(s_class):
+                    self._write_snapshot(cls)
+                    self._reset_journal(cls)
+        finally:
+            self._compacting.discard(s_class)
+
+    def _reset_journal(self, cls: type):
+        """ Replace the journal, now folded into the snapshot, by one
+        whose header names the folded journal version
+        """
+        s_class = cls.__name__
+        journal_path = self.journal_path(cls)
+        folded = _signature(journal_path)
+        header = (json.dumps({
+            "op": "compact", "folded": list(folded[:2]) if folded else None
+        }) + "\n").encode()
+        tmp_path = "{}.{}.tmp".format(journal_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+        # Replaying the journal is idempotent, so a crash before this
+        # replacement loses nothing
+        os.replace(tmp_path, journal_path)
+        self._journal_sizes[s_class] = 0
+        state = self._file_state.get(s_class)
+        if state is not None:
+            state["journal"] = _signature(journal_path)[0]
+            state["offset"] = len(header)
+
+    def _persist(self, cls: type, record: dict) -> bool:
+        """ Persist one mutation according to the storage mode, and
+        return True when the caller must still rewrite the class file
+        """
+        if JOURNAL:
+            if "obj" in record:
+                record = {"op": "save", "obj": record["obj"].to_json(True)}
+            self._append_journal(cls, record)
+        elif WRITE_BEHIND:
+            obj_id = record["obj"].id if "obj" in record else record["id"]
+            self._mark_dirty(cls, _shards_of(obj_id))
+        else:
+            return True
+        return False
+
+    def _mark_dirty(self, cls: type, shards: set = None):
+        """ Schedule a class, or some of its shards, for the next
+        write-behind flush
+        """
+        with self._dirty_lock:
+            _, count, dirty = self._dirty.get(
+                cls.__name__, (cls, 0, set()))
+            self._dirty[cls.__name__] = (
+                cls, count + 1, _merge_shards(dirty, shards))
+            pending = sum(count for _, count, _ in self._dirty.values())
+            if self._flusher is None:
+                self._flusher = threading.Thread(
+                    target=self._flush_loop, daemon=True
+                )
+                self._flusher.start()
+        if pending >= FLUSH_BATCH:
+            self._flush_wakeup.set()
+
+    def _flush_loop(self):
+        """ Background thread body of the write-behind mode
+        """
+        while True:
+            self._flush_wakeup.wait(FLUSH_INTERVAL)
+            self._flush_wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # The failed classes are pending again, so the next tick
+                # or the flush at exit retries them
+                logger.exception("write-behind flush failed")
+
+    def flush(self, cls: type = None):
+        """ Write every class with pending write-behind changes to file,
+        or only cls when given
+        """
+        with self._dirty_lock:
+            if cls is None:
+                dirty = list(self._dirty.values())
+                self._dirty.clear()
+            else:
+                entry = self._dirty.pop(cls.__name__, None)
+                dirty = [entry] if entry else []
+        for index, (dirty_cls, _, shards) in enumerate(dirty):
+            try:
+                self.save_all(dirty_cls, shards)
+            except BaseException:
+                self._requeue(dirty[index:])
+                raise
+
+    def _requeue(self, dirty: list):
+        """ Mark (cls, count, shards) entries taken by a failed flush as
+        pending again, merged with the changes made since
+        """
+        with self._dirty_lock:
+            for cls, count, shards in dirty:
+                _, pending, pending_shards = self._dirty.get(
+                    cls.__name__, (cls, 0, set()))
+                self._dirty[cls.__name__] = (
+                    cls, pending + count,
+                    _merge_shards(pending_shards, shards))
+
+    @contextmanager
+    def batch(self):
+        """ Rewrite each class file once when the block exits instead of
+        on every save and remove made by this thread in it
+
+        Only the default mode rewrites files on each mutation; journal
+        and write-behind modes are left as they are. In sync mode the
+        cross-process lock of each class is held until the rewrite, so
+        no other process can change the file in between.
+        """
+        if getattr(self._held, "batch", None) is not None:
+            yield
+            return
+        pending = self._held.batch = {}
+        with ExitStack() as stack:
+            self._held.batch_locks = stack
+            try:
+                yield
+            finally:
+                # Memory already holds the changes, so they are written
+                # even when the block raised
+                self._held.batch = None
+                for cls, shards in pending.values():
+                    self.save_all(cls, shards)
+
+    def _join_batch(self, cls: type, obj_id: str) -> bool:
+        """ Add the shard of an object to the open batch of this thread,
+        and return True when its file rewrite is deferred to the end of
+        the batch
+        """
+        pending = getattr(self._held, "batch", None)
+        if pending is None or JOURNAL or WRITE_BEHIND:
+            return False
+        s_class = cls.__name__
+        if s_class not in pending:
+            self._held.batch_locks.enter_context(
+                self._process_lock(cls, exclusive=True))
+            pending[s_class] = (cls, set())
+        pending[s_class] = (
+            cls, _merge_shards(pending[s_class][1], _shards_of(obj_id)))
+        return True
+
+    def upsert(self, obj: TypeVar('Base')):
+        """ Save one object
+        """
+        cls = obj.__class__
+        batched = self._join_batch(cls, obj.id)
+        with self._process_lock(cls, exclusive=not JOURNAL):
+            if SYNC and not JOURNAL:
+                # The rewrite must not drop other processes' changes
+                self.refresh(cls, force=True)
+            with self._lock(cls.__name__).write():
+                self._store(cls, obj)
+                rewrite = self._persist(cls, {"op": "save", "obj": obj})
+            if rewrite and not batched:
+                # Outside the write lock so reads are not held up by the
+                # file; the snapshot includes this and any later mutation
+                self.save_all(cls, _shards_of(obj.id))
+
+    def delete(self, obj: TypeVar('Base')):
+        """ Remove one object
+        """
+        cls = obj.__class__
+        batched = self._join_batch(cls, obj.id)
+        rewrite = False
+        with self._process_lock(cls, exclusive=not JOURNAL):
+            if SYNC and not JOURNAL:
+                self.refresh(cls, force=True)
+            with self._lock(cls.__name__).write():
+                if self._objects(cls).get(obj.id) is not None:
+                    self._discard(cls, obj.id)
+                    rewrite = self._persist(
+                        cls, {"op": "remove", "id": obj.id})
+            if rewrite and not batched:
+                self.save_all(cls, _shards_of(obj.id))
+
+    def count(self, cls: type) -> int:
+        """ Count all objects
+        """
+        if SYNC:
+            self.refresh(cls)
+        # Single dict operations are atomic and need no lock
+        return len(self._objects(cls))
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        if SYNC:
+            self.refresh(cls)
+        return self._materialize(cls, self._objects(cls).get(obj_id))
+
+    def _sorted(self, cls: type) -> List[str]:
+        """ Sorted ids of a class
+        """
+        s_class = cls.__name__
+        ids = self._sorted_ids.get(s_class)
+        if ids is None:
+            with self._lock(s_class).write():
+                ids = self._sorted_ids.get(s_class)
+                if ids is None:
+                    ids = sorted(self._objects(cls))
+                    self._sorted_ids[s_class] = ids
+        return ids
+
+    def _sorted_index(self, cls: type, k: str,
+                      reverse: bool = False) -> List[Tuple[str, str]]:
+        """ Sorted (key, id) pairs of attribute k, built on first use
+        """
+        s_class = cls.__name__
+        indexes = self._sorted_indexes.setdefault(s_class, {})
+        index = indexes.get((k, reverse))
+        if index is None:
+            with self._lock(s_class).write():
+                indexes = self._sorted_indexes.setdefault(s_class, {})
+                index = indexes.get((k, reverse))
+                if index is None:
+                    by_id = {}
+                    for obj_id, entry in self._objects(cls).items():
+                        key = _entry_key(entry, k, reverse)
+                        if key is not None:
+                            by_id[obj_id] = key
+                    keys = sorted((key, i) for i, key in by_id.items())
+                    index = indexes[(k, reverse)] = (keys, by_id)
+        return index[0]
+
+    def _sorted_lookup(self, cls: type, k: str,
+                       condition: Condition) -> List[str]:
+        """ Ids whose attribute k may satisfy condition, found in a
+        sorted index in O(log n + k), or None if no index applies
+        """
+        if k not in cls.SORTED_ATTRIBUTES:
+            return None
+        if isinstance(condition, Range):
+            low, high = condition.low_key, condition.high_key
+            if not all(b is None or type(b) is str for b in (low, high)):
+                return None
+            keys = self._sorted_index(cls, k)
+            with self._lock(cls.__name__).read():
+                start = 0 if low is None else bisect_left(keys, (low,))
+                end = len(keys) if high is None else \
+                    bisect_left(keys, (high,))
+                return [obj_id for _, obj_id in keys[start:end]]
+        if isinstance(condition, In):
+            wanted = [sort_key(v) for v in condition.values]
+            if None in wanted:
+                return None
+            reverse, prefixes = False, set(wanted)
+        elif isinstance(condition, Prefix):
+            reverse, prefixes = False, [condition.prefix]
+        elif isinstance(condition, Suffix):
+            reverse, prefixes = True, [condition.suffix[::-1]]
+        else:
+            return None
+        keys = self._sorted_index(cls, k, reverse)
+        # In matches whole keys, the others key prefixes
+        exact = isinstance(condition, In)
+        ids = []
+        with self._lock(cls.__name__).read():
+            for prefix in prefixes:
+                i = bisect_left(keys, (prefix,))
+                while i < len(keys) and keys[i][0].startswith(prefix):
+                    if exact and keys[i][0] != prefix:
+                        break
+                    ids.append(keys[i][1])
+                    i += 1
+        return ids
+
+    def _candidates(self, cls: type, attributes: dict) -> List[str]:
+        """ Ids narrowing a search through an index, or None when no
+        queried attribute has an index; equalities are tried first
+        """
+        s_class = cls.__name__
+        indexes = self.indexes.get(s_class, {})
+        conditions = []
+        for k, v in attributes.items():
+            if isinstance(v, Condition):
+                conditions.append((k, v))
+                continue
+            if k == "id" and isinstance(v, str):
+                return [v]
+            index = indexes.get(k)
+            if k not in cls.INDEXED_ATTRIBUTES or index is None:
+                continue
+            try:
+                with self._lock(s_class).read():
+                    return list(index.get(v, ()))
+            except TypeError:
+                continue
+        for k, v in conditions:
+            if isinstance(v, In) and k == "id":
+                return [i for i in dict.fromkeys(v.values)
+                        if isinstance(i, str)]
+            index = indexes.get(k)
+            if isinstance(v, In) and k in cls.INDEXED_ATTRIBUTES and \
+                    index is not None:
+                try:
+                    with self._lock(s_class).read():
+                        ids = [i for value in v.values
+                               for i in index.get(value, ())]
+                    return list(dict.fromkeys(ids))
+                except TypeError:
+                    continue
+            ids = self._sorted_lookup(cls, k, v)
+            if ids is not None:
+                return ids
+        return None
+
+    def _scan_sorted(self, cls: type, after: str = None) -> Iterator[str]:
+        """ Yield the ids of a class in order, copying them a chunk at a
+        time under the read lock so concurrent writes are never seen
+        half done
+        """
+        s_class = cls.__name__
+        # Short first chunk: most scans only want one page
+        size = 32
+        while True:
+            self._sorted(cls)
+            with self._lock(s_class).read():
+                ids = self._sorted_ids[s_class]
+                if ids is None:
+                    # Reloaded meanwhile
+                    continue
+                start = 0 if after is None else bisect_right(ids, after)
+                chunk = ids[start:start + size]
+            yield from chunk
+            if len(chunk) < size:
+                return
+            after = chunk[-1]
+            size = min(size * 2, SCAN_CHUNK)
+
+    def iter_search(self, cls: type, attributes: dict, after: str = None,
+                    ordered: bool = False) -> Iterator[TypeVar('Base')]:
+        """ Lazily yield the objects with matching attributes
+        """
+        if SYNC:
+            self.refresh(cls)
+        ordered = ordered or after is not None
+        objects = self._objects(cls)
+        ids = self._candidates(cls, attributes)
+        if ids is not None:
+            # The index narrows the scan; every attribute is still
+            # checked against the live objects
+            if ordered:
+                ids.sort()
+            if after is not None:
+                ids = ids[bisect_right(ids, after):]
+        elif ordered:
+            ids = self._scan_sorted(cls, after)
+        else:
+            with self._lock(cls.__name__).read():
+                ids = list(objects)
+        # No lock is held while the caller consumes the results
+        for obj_id in ids:
+            obj = self._materialize(cls, objects.get(obj_id))
+            if obj is not None and _matches(obj, attributes):
+                yield obj
+
+    def search(self, cls: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes
+        """
+        return list(self.iter_search(cls, attributes))
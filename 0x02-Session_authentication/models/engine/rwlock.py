@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+""" Readers/writer lock
+"""
+import threading
+
+
+class _Holder():
+    """ Context manager taking one side of a lock
+    """
+    __slots__ = ('_acquire', '_release')
+
+    def __init__(self, acquire, release):
+        """ Initialize from the acquire and release functions
+        """
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        """ Acquire the lock
+        """
+        self._acquire()
+
+    def __exit__(self, *args):
+        """ Release the lock
+        """
+        self._release()
+
+
+class RWLock():
+    """ Lock shared by any number of readers or held by one writer
+
+    Waiting writers block new readers so a steady stream of reads cannot
+    starve them. The write side is reentrant and its holder may also
+    take the read side; read sections must not nest, nor be upgraded to
+    write sections, or they may deadlock with a waiting writer.
+
+    Use `with lock.read():` or `with lock.write():`.
+    """
+
+    def __init__(self):
+        """ Initialize an unlocked lock
+        """
+        self._mutex = threading.Lock()
+        self._cond = threading.Condition(self._mutex)
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+        self._read = _Holder(self.acquire_read, self.release_read)
+        self._write = _Holder(self.acquire_write, self.release_write)
+
+    def read(self) -> _Holder:
+        """ Context manager holding the lock as a reader
+        """
+        return self._read
+
+    def write(self) -> _Holder:
+        """ Context manager holding the lock as the only writer
+        """
+        return self._write
+
+    def acquire_read(self):
+        """ Take the lock as a reader
+        """
+        writer = self._writer
+        if writer is not None and writer == threading.get_ident():
+            # Reading inside this thread's own write section
+            return
+        with self._mutex:
+            while self._writer is not None or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        """ Release a read acquisition
+        """
+        writer = self._writer
+        if writer is not None and writer == threading.get_ident():
+            return
+        with self._mutex:
+            self._readers -= 1
+            if not self._readers and self._waiting_writers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        """ Take the lock as the only writer
+        """
+        me = threading.get_ident()
+        if self._writer != me:
+            with self._mutex:
+                self._waiting_writers += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._cond.wait()
+                finally:
+                    self._waiting_writers -= 1
+                self._writer = me
+        self._writer_depth += 1
+
+    def release_write(self):
+        """ Release a write acquisition
+        """
+        self._writer_depth -= 1
+        if not self._writer_depth:
+            with self._mutex:
+                self._writer = None
+                self._cond.notify_all()
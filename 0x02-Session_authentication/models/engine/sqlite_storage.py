@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+""" SQLite storage engine
+"""
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple, TypeVar
+import json
+import sqlite3
+import threading
+
+from models.engine.storage import Storage
+from models.query import Condition, In, Prefix, Range, Suffix, matches
+
+
+# Python types that can be stored in, and compared by, SQLite columns
+_SQL_TYPES = (str, int, float)
+
+
+def _quote(name: str) -> str:
+    """ Quote an SQL identifier
+    """
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+class SQLiteStorage(Storage):
+    """ Stores each class in an SQLite table
+
+    Every row keeps the full JSON record of its object in `data`, plus
+    one indexed column per INDEXED_ATTRIBUTES and SORTED_ATTRIBUTES
+    entry so lookups on those attributes are answered by SQLite
+    indexes. Each write is its own transaction, and a batch() block is
+    one transaction.
+    """
+
+    def __init__(self, db_path: str):
+        """ Initialize the storage on an SQLite database file
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        self._tables = set()
+        self._schema_lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """ Connection of the current thread
+        """
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            # WAL lets readers run while another connection writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """ Transaction of a write, or the enclosing batch() transaction
+        """
+        conn = self.connection
+        if getattr(self._local, "batch", False):
+            yield conn
+            return
+        with conn:
+            yield conn
+
+    @contextmanager
+    def batch(self):
+        """ Run the writes of this thread in the block in one transaction,
+        rolled back if the block raises
+        """
+        if getattr(self._local, "batch", False):
+            yield
+            return
+        self._local.batch = True
+        try:
+            with self.connection:
+                yield
+        finally:
+            self._local.batch = False
+
+    def _columns(self, cls: type) -> Tuple[str, ...]:
+        """ Indexed columns of a class table
+        """
+        names = cls.INDEXED_ATTRIBUTES + cls.SORTED_ATTRIBUTES
+        return tuple(k for k in dict.fromkeys(names) if k != "id")
+
+    def _table(self, cls: type) -> str:
+        """ Create the table of a class if needed and return its name
+        """
+        table = _quote(cls.__name__)
+        if cls.__name__ in self._tables:
+            return table
+        with self._schema_lock:
+            conn = self.connection
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS {} ("
+                    "id TEXT PRIMARY KEY, data TEXT NOT NULL)".format(table)
+                )
+                existing = {row[1] for row in conn.execute(
+                    "PRAGMA table_info({})".format(table))}
+                added = [k for k in self._columns(cls) if k not in existing]
+                for k in added:
+                    conn.execute("ALTER TABLE {} ADD COLUMN {}".format(
+                        table, _quote(k)))
+                for k in self._columns(cls):
+                    conn.execute("CREATE INDEX IF NOT EXISTS {} ON {} ({})"
+                                 .format(_quote("ix_{}_{}".format(
+                                     cls.__name__, k)), table, _quote(k)))
+                if added:
+                    self._backfill(cls, table, added)
+            self._tables.add(cls.__name__)
+        return table
+
+    def _backfill(self, cls: type, table: str, columns: List[str]):
+        """ Fill newly added indexed columns from the stored records
+        """
+        conn = self.connection
+        rows = conn.execute("SELECT id, data FROM {}".format(table))
+        updates = []
+        for obj_id, data in rows.fetchall():
+            record = json.loads(data)
+            updates.append([self._column_value(record.get(k))
+                            for k in columns] + [obj_id])
+        conn.executemany("UPDATE {} SET {} WHERE id = ?".format(
+            table, ", ".join("{} = ?".format(_quote(k)) for k in columns)
+        ), updates)
+
+    @staticmethod
+    def _column_value(value):
+        """ Value stored in an indexed column; other types are left NULL
+        and matched in Python
+        """
+        return value if isinstance(value, _SQL_TYPES) else None
+
+    @staticmethod
+    def _condition_sql(column: str, condition: Condition,
+                       params: list) -> str:
+        """ SQL narrowing a column to the rows that may satisfy a
+        condition, or None; rows are still checked in Python
+        """
+        def usable(value):
+            return isinstance(value, _SQL_TYPES) and \
+                not isinstance(value, bool)
+
+        where = []
+        if isinstance(condition, Range):
+            for bound, op in ((condition.low_key, ">="),
+                              (condition.high_key, "<")):
+                if usable(bound):
+                    where.append("{} {} ?".format(column, op))
+                    params.append(bound)
+        elif isinstance(condition, Prefix) and condition.prefix:
+            prefix = condition.prefix
+            # Every string with the prefix sorts in [prefix, upper)
+            where.append("{} >= ?".format(column))
+            params.append(prefix)
+            if ord(prefix[-1]) < 0x10FFFF:
+                where.append("{} < ?".format(column))
+                params.append(prefix[:-1] + chr(ord(prefix[-1]) + 1))
+        elif isinstance(condition, Suffix) and condition.suffix:
+            where.append("substr({}, -?) = ?".format(column))
+            params.extend((len(condition.suffix), condition.suffix))
+        elif isinstance(condition, In) and all(
+                usable(v) for v in condition.values):
+            where.append("{} IN ({})".format(
+                column, ", ".join("?" * len(condition.values))))
+            params.extend(condition.values)
+        return " AND ".join(where) if where else None
+
+    def _build(self, cls: type, data: str) -> TypeVar('Base'):
+        """ Build an object from its stored JSON record
+        """
+        return cls(**json.loads(data))
+
+    def load(self, cls: type):
+        """ Make sure the table of the class exists
+        """
+        self._table(cls)
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID
+        """
+        row = self.connection.execute(
+            "SELECT data FROM {} WHERE id = ?".format(self._table(cls)),
+            (obj_id,)
+        ).fetchone()
+        return self._build(cls, row[0]) if row else None
+
+    def iter_search(self, cls: type, attributes: dict, after: str = None,
+                    ordered: bool = False) -> Iterator[TypeVar('Base')]:
+        """ Lazily yield the objects with matching attributes
+        """
+        table = self._table(cls)
+        columns = ("id",) + self._columns(cls)
+        where = []
+        params = []
+        for k, v in attributes.items():
+            if k not in columns:
+                continue
+            if isinstance(v, Condition):
+                sql = self._condition_sql(_quote(k), v, params)
+                if sql:
+                    where.append(sql)
+            elif v is None:
+                where.append("{} IS NULL".format(_quote(k)))
+            elif isinstance(v, _SQL_TYPES) and not isinstance(v, bool):
+                where.append("{} = ?".format(_quote(k)))
+                params.append(v)
+        if after is not None:
+            where.append("id > ?")
+            params.append(after)
+        query = "SELECT data FROM {}".format(table)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        if ordered or after is not None:
+            query += " ORDER BY id"
+        else:
+            query += " ORDER BY rowid"
+
+        for (data,) in self.connection.execute(query, params):
+            obj = self._build(cls, data)
+            # Columns only narrow the scan; every attribute is checked
+            # on the object, like the file storage does
+            if all(matches(getattr(obj, k), v)
+                   for k, v in attributes.items()):
+                yield obj
+
+    def upsert(self, obj: TypeVar('Base')):
+        """ Insert or update one object in a single transaction
+        """
+        cls = obj.__class__
+        table = self._table(cls)
+        columns = self._columns(cls)
+        record = obj.to_json(True)
+        # Columns hold the stored form, so timestamps are compared as
+        # the text they are saved as
+        values = [self._column_value(record.get(k)) for k in columns]
+        data = json.dumps(record)
+        with self._transaction() as conn:
+            # UPDATE first keeps the rowid, and so the insertion order
+            cursor = conn.execute("UPDATE {} SET {} WHERE id = ?".format(
+                table, ", ".join("{} = ?".format(_quote(k))
+                                 for k in ("data",) + columns)
+            ), [data] + values + [obj.id])
+            if cursor.rowcount == 0:
+                conn.execute("INSERT INTO {} ({}) VALUES ({})".format(
+                    table,
+                    ", ".join(_quote(k) for k in ("id", "data") + columns),
+                    ", ".join("?" * (len(columns) + 2))
+                ), [obj.id, data] + values)
+
+    def delete(self, obj: TypeVar('Base')):
+        """ Delete one object
+        """
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM {} WHERE id = ?".format(
+                self._table(obj.__class__)), (obj.id,))
+
+    def count(self, cls: type) -> int:
+        """ Count all objects
+        """
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM {}".format(self._table(cls))
+        ).fetchone()[0]
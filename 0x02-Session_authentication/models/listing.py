@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+""" JSON listings of model objects
+"""
+import threading
+from typing import Iterable, TypeVar
+
+
+class JsonListing():
+    """ JSON array of the to_json() of a sequence of objects
+
+    Each object caches its own text until it is mutated, and the array
+    is only assembled again when one of its texts changed, so repeated
+    listings of unchanged objects serialize nothing.
+    """
+
+    def __init__(self):
+        """ Initialize an empty listing
+        """
+        self._lock = threading.Lock()
+        self._texts = []
+        self._payload = "[]"
+
+    def render(self, objects: Iterable[TypeVar('Base')]) -> str:
+        """ JSON array of the objects, in order
+        """
+        texts = [obj.to_json_text() for obj in objects]
+        with self._lock:
+            # Unchanged objects return the very same cached text
+            if len(texts) == len(self._texts) and \
+                    all(a is b for a, b in zip(texts, self._texts)):
+                return self._payload
+        payload = "[" + ",".join(texts) + "]"
+        with self._lock:
+            self._texts, self._payload = texts, payload
+        return payload
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+""" Password hashing of the models
+
+Passwords are hashed with salted scrypt and stored as
+"scrypt$<n>$<r>$<p>$<salt>$<hash>" (hex salt and hash). Hashes of the
+older unsalted SHA-256 scheme are still verified, and reported by
+needs_rehash() so they are upgraded on the next successful login.
+
+Hashing and verification run on a bounded worker pool: at most
+PASSWORD_WORKERS run at once and PASSWORD_QUEUE_DEPTH more wait, any
+further call raises PasswordPoolFull instead of tying up its thread.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from typing import Callable, Optional, Tuple
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+
+# scrypt cost: n is the CPU/memory cost (a power of 2), r the block
+# size and p the parallelization; changing them upgrades stored hashes
+SCRYPT_N = int(getenv("PASSWORD_SCRYPT_N", 2 ** 14))
+SCRYPT_R = int(getenv("PASSWORD_SCRYPT_R", 8))
+SCRYPT_P = int(getenv("PASSWORD_SCRYPT_P", 1))
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+PASSWORD_WORKERS = int(getenv("PASSWORD_WORKERS", os.cpu_count() or 1))
+PASSWORD_QUEUE_DEPTH = int(getenv("PASSWORD_QUEUE_DEPTH", 64))
+
+# Latest samples kept for the latency metrics of each operation
+METRIC_SAMPLES = 1000
+
+
+class PasswordPoolFull(Exception):
+    """ Raised when the hashing pool queue is full
+    """
+
+
+def _scrypt(pwd: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    """ scrypt digest of a password
+    """
+    # Room for the 128 * n * r bytes scrypt needs, plus some slack
+    return hashlib.scrypt(pwd.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r + 1024 * 1024,
+                          dklen=HASH_BYTES)
+
+
+def _is_sha256(stored: str) -> bool:
+    """ True for a hash of the unsalted SHA-256 scheme
+    """
+    return len(stored) == 64 and "$" not in stored
+
+
+def hash_password(pwd: str) -> str:
+    """ Salted scrypt hash of a password, on the calling thread
+    """
+    salt = os.urandom(SALT_BYTES)
+    digest = _scrypt(pwd, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return "scrypt${}${}${}${}${}".format(
+        SCRYPT_N, SCRYPT_R, SCRYPT_P, salt.hex(), digest.hex())
+
+
+def check_password(stored: str, pwd: str) -> bool:
+    """ True if pwd matches a stored hash, on the calling thread
+    """
+    if _is_sha256(stored):
+        digest = hashlib.sha256(pwd.encode()).hexdigest()
+        return hmac.compare_digest(digest, stored.lower())
+    try:
+        scheme, n, r, p, salt, digest = stored.split("$")
+        if scheme != "scrypt":
+            return False
+        expected = bytes.fromhex(digest)
+        actual = _scrypt(pwd, bytes.fromhex(salt), int(n), int(r), int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+def needs_rehash(stored: str) -> bool:
+    """ True if a stored hash is not a scrypt hash at the current cost
+    """
+    return not stored.startswith("scrypt${}${}${}$".format(
+        SCRYPT_N, SCRYPT_R, SCRYPT_P))
+
+
+def verify_and_upgrade(stored: str, pwd: str) -> Tuple[bool, Optional[str]]:
+    """ Check a password and return a fresh hash when the stored one is
+    outdated
+
+    Returns (valid, new_hash); new_hash is None unless it must be stored.
+    """
+    if not check_password(stored, pwd):
+        return False, None
+    if needs_rehash(stored):
+        return True, hash_password(pwd)
+    return True, None
+
+
+class HashingPool():
+    """ Bounded thread pool running password hashes and checks
+
+    hashlib.scrypt releases the GIL, so the workers hash in parallel
+    while the calling threads wait for their result.
+    """
+
+    def __init__(self, workers: int, queue_depth: int):
+        """ Initialize a pool of workers with queue_depth waiting slots
+        """
+        self.workers = workers
+        self.queue_depth = queue_depth
+        # Started on first use, so forked workers each get their own
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._rejected = 0
+        # operation -> {"count", "queue_wait", "latency"}
+        self._samples = {}
+
+    def _pool(self) -> ThreadPoolExecutor:
+        """ Executor of the pool
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="password")
+            return self._executor
+
+    def run(self, operation: str, func: Callable, *args: list):
+        """ Run func(*args) on the pool and return its result; operation
+        names it in the metrics
+
+        Raises PasswordPoolFull when every worker and waiting slot is
+        taken.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise PasswordPoolFull()
+        submitted = time.perf_counter()
+        with self._lock:
+            self._in_flight += 1
+
+        def task():
+            started = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                self._record(operation, started - submitted,
+                             time.perf_counter() - started)
+        try:
+            return self._pool().submit(task).result()
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def _record(self, operation: str, queue_wait: float, latency: float):
+        """ Add the timings of one call to the metrics
+        """
+        with self._lock:
+            samples = self._samples.get(operation)
+            if samples is None:
+                samples = self._samples[operation] = {
+                    "count": 0,
+                    "queue_wait": deque(maxlen=METRIC_SAMPLES),
+                    "latency": deque(maxlen=METRIC_SAMPLES),
+                }
+            samples["count"] += 1
+            samples["queue_wait"].append(queue_wait)
+            samples["latency"].append(latency)
+
+    def metrics(self) -> dict:
+        """ Size, load and, per operation, queue wait and latency in
+        milliseconds over the latest calls
+        """
+        def summary(values):
+            values = sorted(values)
+            if not values:
+                return {}
+            return {
+                "mean": sum(values) / len(values) * 1e3,
+                "p50": values[len(values) // 2] * 1e3,
+                "p99": values[int(len(values) * 0.99)] * 1e3,
+                "max": values[-1] * 1e3,
+            }
+
+        with self._lock:
+            operations = {
+                operation: {
+                    "count": samples["count"],
+                    "queue_wait_ms": summary(samples["queue_wait"]),
+                    "latency_ms": summary(samples["latency"]),
+                } for operation, samples in self._samples.items()
+            }
+            return {
+                "workers": self.workers,
+                "queue_depth": self.queue_depth,
+                "in_flight": self._in_flight,
+                "rejected": self._rejected,
+                "operations": operations,
+            }
+
+
+pool = HashingPool(PASSWORD_WORKERS, PASSWORD_QUEUE_DEPTH)
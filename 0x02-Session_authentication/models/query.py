@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+""" Search conditions beyond equality
+
+Conditions are passed as values of a search:
+
+    User.search({"created_at": Range(start, end)})
+    User.search({"email": Domain("example.com")})
+"""
+from datetime import datetime
+from typing import Iterable
+
+
+def sort_key(value) -> str:
+    """ Key of a value in sorted indexes, or None if it is not indexed
+
+    Timestamps sort as their ISO text, which is also how they are
+    stored, so loaded and raw records get comparable keys.
+    """
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, str):
+        return value
+    return None
+
+
+def matches(value, condition) -> bool:
+    """ True if an attribute value satisfies a search value: a
+    Condition, or any other value it must be equal to
+    """
+    if isinstance(condition, Condition):
+        return condition.matches(value)
+    return value == condition
+
+
+class Condition():
+    """ Predicate on one attribute
+    """
+
+    def matches(self, value) -> bool:
+        """ True if the value satisfies the condition
+        """
+        raise NotImplementedError()
+
+
+class Range(Condition):
+    """ low <= value < high; either bound can be left out
+    """
+
+    def __init__(self, low=None, high=None):
+        """ Initialize from the bounds
+        """
+        self.low = low
+        self.high = high
+        # Bounds compared with sort keys, so timestamps and their text
+        # compare alike
+        low_key = sort_key(low)
+        high_key = sort_key(high)
+        self.low_key = low if low_key is None else low_key
+        self.high_key = high if high_key is None else high_key
+
+    def matches(self, value) -> bool:
+        """ True if the value is within the bounds
+        """
+        key = sort_key(value)
+        if key is not None:
+            value = key
+        try:
+            return (self.low_key is None or self.low_key <= value) and \
+                (self.high_key is None or value < self.high_key)
+        except TypeError:
+            return False
+
+
+class Prefix(Condition):
+    """ Strings starting with a prefix
+    """
+
+    def __init__(self, prefix: str):
+        """ Initialize from the prefix
+        """
+        self.prefix = prefix
+
+    def matches(self, value) -> bool:
+        """ True if the value starts with the prefix
+        """
+        return isinstance(value, str) and value.startswith(self.prefix)
+
+
+class Suffix(Condition):
+    """ Strings ending with a suffix
+    """
+
+    def __init__(self, suffix: str):
+        """ Initialize from the suffix
+        """
+        self.suffix = suffix
+
+    def matches(self, value) -> bool:
+        """ True if the value ends with the suffix
+        """
+        return isinstance(value, str) and value.endswith(self.suffix)
+
+
+class Domain(Suffix):
+    """ Email addresses of a domain
+    """
+
+    def __init__(self, domain: str):
+        """ Initialize from the domain, without "@"
+        """
+        super().__init__("@" + domain)
+        self.domain = domain
+
+
+class In(Condition):
+    """ Values equal to one of several values
+    """
+
+    def __init__(self, values: Iterable):
+        """ Initialize from the accepted values
+        """
+        self.values = list(values)
+
+    def matches(self, value) -> bool:
+        """ True if the value equals one of the accepted values
+        """
+        return value in self.values
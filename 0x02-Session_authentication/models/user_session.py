@@ -8,6 +8,10 @@ from models.base import Base
 class UserSession(Base):
     """ UserSession model for storing sessions """
 
+    __slots__ = ('user_id', 'session_id')
+
+    INDEXED_ATTRIBUTES = ('session_id',)
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initializes a UserSession instance """
         self.user_id = kwargs.get('user_id')
@@ -24,8 +28,7 @@ class UserSession(Base):
     @classmethod
     def get(cls, session_id):
         """ Get a UserSession instance by session_id """
-        instances = cls.search({'session_id': session_id})
-        return instances[0] if instances else None
+        return cls.first({'session_id': session_id})
 
     @classmethod
     def delete(cls, session_id):